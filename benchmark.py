@@ -0,0 +1,778 @@
+"""
+Benchmarks of the upload paths against a local stand-in for CouchDB.
+
+The stand-in answers the handful of CouchDB endpoints used by this project, so the benchmarks measure the cost of
+the client side without a real database.
+
+    python benchmark.py transport              curl against the HTTP transport
+    python benchmark.py ingest --rows 100000   the whole ingest of a synthetic CSV, stage by stage
+    python benchmark.py reader --columns 200   the row by row and column-wise CSV readers
+    python benchmark.py serializer             the str().replace() bodies against db_serialize
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import db_buckets as buckets_methods
+import db_async as async_methods
+import db_cache as cache_methods
+import db_columnar as columnar_methods
+import db_journal as journal_methods
+import db_methods as methods
+import db_metrics as metrics_methods
+import db_module
+import db_serialize as serialize_methods
+import db_transport as transport_methods
+import db_types as types_methods
+
+# Ingest stages timed one after the other by `time_stages`. "escape" is the shell escaping of the old curl path,
+# which the HTTP path no longer uses, kept to compare against "serialize".
+STAGES = ("parse", "types", "escape", "serialize", "upload", "views")
+# A result this much worse than the baseline counts as a regression.
+TOLERANCE = 0.2
+
+
+class FakeCouchHandler(BaseHTTPRequestHandler):
+    """
+    Answers database creation, design document, `_all_docs` and `_bulk_docs` requests like CouchDB would.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, result):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def _split(self):
+        url = urllib.parse.urlsplit(self.path)
+        return url.path.strip("/").split("/", 1), dict(urllib.parse.parse_qsl(url.query))
+
+    def _store(self, database, doc):
+        old = database.get(doc["_id"])
+        if old is not None and old["_rev"] != doc.get("_rev"):
+            return {"id": doc["_id"], "error": "conflict", "reason": "Document update conflict."}
+        generation = int(old["_rev"].split("-")[0]) + 1 if old is not None else 1
+        doc["_rev"] = str(generation) + "-0"
+        database[doc["_id"]] = doc
+        return {"ok": True, "id": doc["_id"], "rev": doc["_rev"]}
+
+    def do_PUT(self):
+        body = self._body()
+        parts, query = self._split()
+        databases = self.server.databases
+        if len(parts) == 1:
+            if parts[0] in databases:
+                self._reply(412, {"error": "file_exists", "reason": "The database could not be created."})
+            else:
+                databases[parts[0]] = {}
+                self._reply(201, {"ok": True})
+        elif parts[0] not in databases:
+            self._reply(404, {"error": "not_found", "reason": "Database does not exist."})
+        else:
+            doc = json.loads(body) if body else {}
+            doc["_id"] = parts[1]
+            result = self._store(databases[parts[0]], doc)
+            self._reply(409 if "error" in result else 201, result)
+
+    def do_DELETE(self):
+        self._body()
+        parts, query = self._split()
+        database = self.server.databases.get(parts[0], {})
+        doc = database.get(parts[-1])
+        if doc is None:
+            self._reply(404, {"error": "not_found", "reason": "missing"})
+        elif doc["_rev"] != query.get("rev"):
+            self._reply(409, {"error": "conflict", "reason": "Document update conflict."})
+        else:
+            del database[parts[-1]]
+            self._reply(200, {"ok": True, "id": parts[-1], "rev": doc["_rev"]})
+
+    def do_GET(self):
+        parts, query = self._split()
+        databases = self.server.databases
+        if parts[0] not in databases:
+            self._reply(404, {"error": "not_found", "reason": "Database does not exist."})
+        elif parts[1:] == ["_design_docs"]:
+            rows = []
+            for doc_id, doc in sorted(databases[parts[0]].items()):
+                if doc_id.startswith("_design/"):
+                    row = {"id": doc_id, "key": doc_id, "value": {"rev": doc["_rev"]}}
+                    if query.get("include_docs") == "true":
+                        row["doc"] = doc
+                    rows.append(row)
+            self._reply(200, {"total_rows": len(rows), "offset": 0, "rows": rows})
+        elif len(parts) == 2 and "/_view/" in parts[1]:
+            self._reply(200, self._view(databases[parts[0]], parts[1], query))
+        elif len(parts) == 2 and parts[1] in databases[parts[0]]:
+            self._reply(200, databases[parts[0]][parts[1]])
+        else:
+            self._reply(404, {"error": "not_found", "reason": "missing"})
+
+    def _view(self, database, view_path, query):
+        """
+        Stands in for the (timestamp, value) views: the view of a grouped design document is named after its
+        header, the "show_specs" view of any other design document is named after the design document. The view
+        of the buckets lists them by the start of their window.
+        """
+        design_id, view_name = view_path.split("/_view/")
+        header = view_name if view_name != "show_specs" else design_id[8:]
+        if database.get(design_id, {}).get("stats_group"):
+            return self._stats_view(database, header, query)
+        if design_id == "_design/" + buckets_methods.BUCKET_DESIGN:
+            rows = sorted((doc["timestamp"], doc_id, len(doc["offsets"])) for doc_id, doc in database.items()
+                          if doc.get("bucket"))
+        else:
+            rows = sorted((doc["timestamp"], doc_id, doc[header]) for doc_id, doc in database.items()
+                          if not doc_id.startswith("_design/") and doc.get("timestamp") and not doc.get("bucket")
+                          and doc.get(header) is not None and doc.get(header) != "")
+        start = (json.loads(query["startkey"]), query.get("startkey_docid", "")) if "startkey" in query else None
+        end = json.loads(query["endkey"]) if "endkey" in query else None
+        rows = [row for row in rows if (start is None or row[:2] >= start) and (end is None or row[0] <= end)]
+        if "limit" in query:
+            rows = rows[:int(query["limit"])]
+        result = [{"id": doc_id, "key": key, "value": value} for key, doc_id, value in rows]
+        if query.get("include_docs") == "true":
+            for row in result:
+                row["doc"] = database[row["id"]]
+        return {"total_rows": len(rows), "offset": 0, "rows": result}
+
+    def _stats_view(self, database, header, query):
+        """
+        Stands in for the statistics views: values are keyed by [year, month, day, hour, minute] and reduced with
+        _stats, grouped by the first `group_level` elements of their key.
+        """
+        samples = []
+        for doc_id, doc in database.items():
+            if doc_id.startswith("_design/") or not doc.get("timestamp") or doc.get(header) is None:
+                continue
+            for row in buckets_methods.iter_bucket_rows(doc) if doc.get("bucket") else [doc]:
+                try:
+                    value = float(row.get(header))
+                except (TypeError, ValueError):
+                    continue
+                timestamp = row["timestamp"]
+                key = [int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]), int(timestamp[11:13]),
+                       int(timestamp[14:16])]
+                samples.append((key, value))
+        start = json.loads(query["startkey"]) if "startkey" in query else None
+        end = json.loads(query["endkey"]) if "endkey" in query else None
+        level = int(query.get("group_level", 0))
+        groups = {}
+        for key, value in samples:
+            if (start is None or key >= start) and (end is None or key <= end):
+                stats = groups.setdefault(tuple(key[:level]), {"sum": 0.0, "count": 0, "min": value, "max": value,
+                                                                "sumsqr": 0.0})
+                stats["sum"] += value
+                stats["count"] += 1
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+                stats["sumsqr"] += value * value
+        return {"rows": [{"key": list(key) if level else None, "value": groups[key]} for key in sorted(groups)]}
+
+    def do_POST(self):
+        body = self._body()
+        parts, query = self._split()
+        databases = self.server.databases
+        if parts[0] not in databases:
+            self._reply(404, {"error": "not_found", "reason": "Database does not exist."})
+            return
+        database = databases[parts[0]]
+        if parts[1:] == ["_all_docs"]:
+            rows = []
+            for doc_id in json.loads(body)["keys"]:
+                doc = database.get(doc_id)
+                if doc is None:
+                    rows.append({"key": doc_id, "error": "not_found"})
+                else:
+                    rows.append({"id": doc_id, "key": doc_id, "value": {"rev": doc["_rev"]}, "doc": doc})
+            self._reply(200, {"total_rows": len(database), "offset": 0, "rows": rows})
+            return
+        results = [self._store(database, doc) for doc in json.loads(body)["docs"]]
+        self._reply(201, results)
+
+
+def start_fake_couchdb(port=0, latency=0.0):
+    """
+    Starts the stand-in CouchDB server in a background thread.
+
+    Parameters
+    ----------
+    port : int
+        (default is 0)
+        Port to listen on, zero picks a free one.
+    latency : float
+        (default is 0.0)
+        Seconds every answer is held back, like the round trip to a remote database.
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        The running server. Its port is `server.server_address[1]`, and `server.shutdown()` stops it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeCouchHandler)
+    server.databases = {}
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_docs(rows, columns, start=datetime.datetime(2020, 1, 1)):
+    """
+    Makes synthetic slow control documents, one per second.
+
+    Parameters
+    ----------
+    rows : int
+        Number of documents.
+    columns : int
+        Number of data fields besides the timestamp.
+    start : datetime
+        (default is 2020-01-01 00:00:00)
+        Timestamp of the first document.
+    Returns
+    -------
+    docs : list
+        The documents, as they come out of `db_methods.csv_to_json`.
+    """
+    docs = []
+    for i in range(rows):
+        timestamp = (start + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+        doc = {"timestamp": timestamp}
+        for j in range(columns):
+            doc["channel_" + str(j)] = str(round(20 + 0.001 * i * (j + 1), 3))
+        doc["_id"] = timestamp
+        docs.append(doc)
+    return docs
+
+
+def bench_curl(port, batches, database):
+    """
+    Times the curl path: one shell and one curl process per batch, as `ssh_execute` runs them.
+    """
+    address = "127.0.0.1:" + str(port)
+    start = time.perf_counter()
+    for batch in batches:
+        command = methods.write_to_database(methods.escape_docs(batch), database)
+        subprocess.run(command.replace("127.0.0.1:5984", address), shell=True, capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def bench_http(port, batches, database):
+    """
+    Times the HTTP path: every batch over the same pool of keep-alive connections.
+    """
+    transport = transport_methods.CouchTransport(None, "127.0.0.1", port)
+    start = time.perf_counter()
+    for batch in batches:
+        transport.request(*methods.write_to_database_request(batch, database))
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return elapsed
+
+
+def run_transport_benchmark(rows=20000, columns=10, max_docs=200):
+    """
+    Compares the curl path with the HTTP transport for the same documents.
+
+    Parameters
+    ----------
+    rows : int
+        (default is 20000)
+        Number of documents to upload.
+    columns : int
+        (default is 10)
+        Number of data fields per document.
+    max_docs : int
+        (default is 200)
+        Number of documents per `_bulk_docs` batch.
+    Returns
+    -------
+    results : dict
+        Seconds taken by each path.
+    """
+    server = start_fake_couchdb()
+    port = server.server_address[1]
+    server.databases["curl"] = {}
+    server.databases["http"] = {}
+    batches = list(methods.batch_documents(make_docs(rows, columns), max_docs=max_docs))
+    results = {"curl": bench_curl(port, batches, "curl"), "http": bench_http(port, batches, "http")}
+    server.shutdown()
+    for path, seconds in results.items():
+        print("%-5s %8.3f s %10.0f rows/s" % (path, seconds, rows / seconds))
+    return results
+
+
+def write_csv(csv_file_path, rows, columns, start=datetime.datetime(2020, 1, 1)):
+    """
+    Writes a synthetic slow control CSV, one row per second.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    rows : int
+        Number of rows.
+    columns : int
+        Number of data columns besides the timestamp.
+    start : datetime
+        (default is 2020-01-01 00:00:00)
+        Timestamp of the first row.
+    Returns
+    -------
+    :int
+        Size of the file in bytes.
+    """
+    with open(csv_file_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["timestamp"] + ["channel_" + str(j) for j in range(columns)])
+        for i in range(rows):
+            timestamp = (start + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+            writer.writerow([timestamp] + [str(round(20 + 0.001 * i * (j + 1), 3)) for j in range(columns)])
+    return os.path.getsize(csv_file_path)
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of this process in bytes, None where it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in kibibytes, macOS in bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def time_stages(csv_file_path, port, database, max_bytes=methods.BATCH_MAX_BYTES, max_docs=methods.BATCH_MAX_DOCS):
+    """
+    Times every stage of the ingest of a CSV on its own, each one finishing before the next starts.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    port : int
+        Port of the stand-in CouchDB.
+    database : str
+        Name of the database, which must exist.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the size of each request body.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents in each request body.
+    Returns
+    -------
+    stages : dict
+        Seconds taken by each of STAGES.
+    """
+    stages = {}
+    start = time.perf_counter()
+    docs = list(methods.iter_csv_file(csv_file_path))
+    stages["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    column_types = types_methods.infer_column_types(docs)
+    typed_docs = [types_methods.convert_document(doc, column_types) for doc in docs]
+    stages["types"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for batch in methods.batch_documents(docs, max_bytes, max_docs):
+        methods.escape_docs(batch)
+    stages["escape"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bodies = list(methods.iter_bulk_bodies(typed_docs, max_bytes, max_docs, counts=True))
+    stages["serialize"] = time.perf_counter() - start
+
+    transport = transport_methods.CouchTransport(None, "127.0.0.1", port)
+    start = time.perf_counter()
+    db_module.upload_bodies(transport, database, bodies)
+    stages["upload"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db_module.reconcile_views(transport, database, methods.read_headers(csv_file_path))
+    stages["views"] = time.perf_counter() - start
+    transport.close()
+    return stages
+
+
+def stream_ingest(csv_file_path, port, database, max_bytes, max_docs, uploads, compress, results):
+    """
+    Records a CSV the way `db_module.record_data_from_csv` does, streaming from the file to the database, and puts
+    the elapsed seconds, the bytes of the request bodies, the bytes actually sent and the peak memory in `results`.
+    Runs in a fresh process, so its peak memory is that of the ingest alone.
+    """
+    cache_methods.CACHE_FILE = os.path.join(os.path.dirname(csv_file_path), "view_cache.json")
+    compress_min_bytes = transport_methods.COMPRESS_MIN_BYTES if compress else None
+    transport = transport_methods.CouchTransport(None, "127.0.0.1", port, pool_size=uploads + 1,
+                                                 compress_min_bytes=compress_min_bytes)
+    start = time.perf_counter()
+    body_bytes = 0
+
+    def measured(bodies):
+        nonlocal body_bytes
+        for body, count in bodies:
+            body_bytes += len(body)
+            yield body, count
+
+    journal = journal_methods.IngestJournal(csv_file_path)
+    bodies = measured(db_module.iter_csv_bodies(csv_file_path, max_bytes, max_docs))
+    async_methods.run(async_methods.concurrently(
+        lambda: db_module.upload_bodies(transport, database, bodies, journal=journal, uploads=uploads),
+        lambda: db_module.reconcile_views(transport, database, methods.read_headers(csv_file_path))))
+    journal.close()
+    elapsed = time.perf_counter() - start
+    transport.close()
+    journal_methods.remove_journal(csv_file_path)
+    sent_bytes = body_bytes - metrics_methods.snapshot()["counters"].get("compressed_bytes_saved", 0)
+    results.put({"seconds": elapsed, "body_bytes": body_bytes, "sent_bytes": sent_bytes, "peak_rss_bytes": peak_rss()})
+
+
+def run_ingest_benchmark(rows=100000, columns=20, max_bytes=methods.BATCH_MAX_BYTES,
+                         max_docs=methods.BATCH_MAX_DOCS, uploads=db_module.UPLOADS, latency=0.0, compress=True):
+    """
+    Measures the ingest of a synthetic CSV against the stand-in CouchDB.
+
+    The CSV is first recorded stage by stage to see where the time goes, then recorded again end to end, streaming,
+    in a fresh process for the throughput and peak memory. With more than one upload the streaming run overlaps the
+    stages, see `db_async`, and takes less than their sum. SSH isn't part of the measurement since the stand-in is
+    reached directly; through a tunnel its cost adds to "upload", which `latency` stands for.
+
+    Parameters
+    ----------
+    rows : int
+        (default is 100000)
+        Number of rows of the CSV.
+    columns : int
+        (default is 20)
+        Number of data columns of the CSV.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the size of each request body.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents in each request body.
+    uploads : int
+        (default is db_module.UPLOADS)
+        Number of bodies in flight at the same time in the streaming run.
+    latency : float
+        (default is 0.0)
+        Seconds the stand-in holds back every answer.
+    compress : bool
+        (default is True)
+        Sends the bodies of the streaming run gzip compressed, see `db_transport.compress_body`.
+    Returns
+    -------
+    results : dict
+        "rows", "columns", "csv_bytes", the seconds of every stage ("stages"), and for the streaming run
+        "seconds", "rows_per_second", "bytes_per_second" (of CSV read), "body_bytes", "sent_bytes" and
+        "peak_rss_bytes".
+    """
+    server = start_fake_couchdb(latency=latency)
+    port = server.server_address[1]
+    cache_file = cache_methods.CACHE_FILE
+    with tempfile.TemporaryDirectory() as directory:
+        # The views of the stand-in go away with it, so they aren't remembered in the project's view cache.
+        cache_methods.CACHE_FILE = os.path.join(directory, "view_cache.json")
+        csv_file_path = os.path.join(directory, "benchmark.csv")
+        csv_bytes = write_csv(csv_file_path, rows, columns)
+        server.databases["benchmark_stream"] = {}
+        context = multiprocessing.get_context("spawn")
+        queue = context.Queue()
+        process = context.Process(target=stream_ingest, args=(csv_file_path, port, "benchmark_stream", max_bytes,
+                                                              max_docs, uploads, compress, queue))
+        process.start()
+        stream = queue.get()
+        process.join()
+        # Linux keeps the peak memory of a process across exec, so the child is started before the stage by stage
+        # run makes this process grow.
+        server.databases["benchmark_stages"] = {}
+        stages = time_stages(csv_file_path, port, "benchmark_stages", max_bytes, max_docs)
+    cache_methods.CACHE_FILE = cache_file
+    server.shutdown()
+    results = {"rows": rows, "columns": columns, "csv_bytes": csv_bytes, "stages": stages}
+    results.update(stream)
+    results["rows_per_second"] = rows / stream["seconds"]
+    results["bytes_per_second"] = csv_bytes / stream["seconds"]
+    print_ingest_results(results)
+    return results
+
+
+def print_ingest_results(results):
+    """
+    Prints the results of `run_ingest_benchmark`.
+    """
+    print("%d rows x %d columns, %.1f MB of CSV" % (results["rows"], results["columns"], results["csv_bytes"] / 1e6))
+    total = sum(results["stages"].values())
+    for stage in STAGES:
+        seconds = results["stages"][stage]
+        print("  %-10s %8.3f s %10.0f rows/s %5.1f %%" % (stage, seconds, results["rows"] / seconds,
+                                                           100 * seconds / total))
+    print("sum        %8.3f s" % total)
+    print("streaming  %8.3f s %10.0f rows/s %8.2f MB/s" % (results["seconds"], results["rows_per_second"],
+                                                          results["bytes_per_second"] / 1e6))
+    print("bodies     %8.2f MB, %.2f MB sent" % (results["body_bytes"] / 1e6, results["sent_bytes"] / 1e6))
+    if results["peak_rss_bytes"] is not None:
+        print("peak RSS   %8.1f MB" % (results["peak_rss_bytes"] / 1e6))
+
+
+def compare_results(results, baseline, tolerance=TOLERANCE):
+    """
+    Finds the measurements that got worse than a baseline by more than `tolerance`.
+
+    Parameters
+    ----------
+    results : dict
+        The results of `run_ingest_benchmark`.
+    baseline : dict
+        Earlier results, e.g. saved with --save.
+    tolerance : float
+        (default is TOLERANCE)
+        Fraction by which a measurement may be worse.
+    Returns
+    -------
+    regressions : list
+        A description of every regression, empty if there is none.
+    """
+    regressions = []
+    for key in ("rows_per_second", "bytes_per_second"):
+        if results[key] < baseline[key] * (1 - tolerance):
+            regressions.append("%s fell from %.0f to %.0f" % (key, baseline[key], results[key]))
+    if baseline.get("peak_rss_bytes") and results["peak_rss_bytes"] and \
+            results["peak_rss_bytes"] > baseline["peak_rss_bytes"] * (1 + tolerance):
+        regressions.append("peak RSS grew from %.1f to %.1f MB" % (baseline["peak_rss_bytes"] / 1e6,
+                                                                    results["peak_rss_bytes"] / 1e6))
+    for stage, seconds in baseline.get("stages", {}).items():
+        if stage in results["stages"] and results["stages"][stage] > seconds * (1 + tolerance):
+            regressions.append("%s grew from %.3f to %.3f s" % (stage, seconds, results["stages"][stage]))
+    return regressions
+
+
+def time_reader(csv_file_path, reader, max_bytes=methods.BATCH_MAX_BYTES, max_docs=methods.BATCH_MAX_DOCS):
+    """
+    Times turning a CSV into typed `_bulk_docs` bodies with one of db_columnar.READERS.
+
+    Returns
+    -------
+    seconds : float
+        The time taken.
+    bodies : list
+        The bodies.
+    """
+    start = time.perf_counter()
+    column_types = types_methods.infer_column_types(methods.iter_csv_file(csv_file_path))
+    if reader == "columnar":
+        docs = columnar_methods.iter_json_documents(csv_file_path, column_types)
+        bodies = list(methods.iter_json_bodies(docs, max_bytes, max_docs))
+    else:
+        docs = types_methods.iter_typed_documents(methods.iter_csv_file(csv_file_path), column_types)
+        bodies = list(methods.iter_bulk_bodies(docs, max_bytes, max_docs))
+    return time.perf_counter() - start, bodies
+
+
+def run_reader_benchmark(rows=20000, columns=(10, 100, 300)):
+    """
+    Compares the row by row and column-wise readers on files of growing width, checking they make the same documents.
+
+    The column-wise reader is timed with pyarrow when it's installed and with the csv module.
+
+    Parameters
+    ----------
+    rows : int
+        (default is 20000)
+        Number of rows of every file.
+    columns : tuple
+        (default is (10, 100, 300))
+        Number of data columns of every file.
+    Returns
+    -------
+    results : list
+        The seconds taken by every reader for every file.
+    """
+    results = []
+    backends = [("columnar", columnar_methods.pyarrow)] if columnar_methods.pyarrow is not None else []
+    backends.append(("columnar (csv)", None))
+    with tempfile.TemporaryDirectory() as directory:
+        for width in columns:
+            csv_file_path = os.path.join(directory, "benchmark_%d.csv" % width)
+            write_csv(csv_file_path, rows, width)
+            seconds, expected = time_reader(csv_file_path, "dict")
+            result = {"columns": width, "dict": seconds}
+            print("%4d columns  dict %8.3f s" % (width, seconds), end="")
+            pyarrow = columnar_methods.pyarrow
+            for name, backend in backends:
+                columnar_methods.pyarrow = backend
+                seconds, bodies = time_reader(csv_file_path, "columnar")
+                columnar_methods.pyarrow = pyarrow
+                # The bodies may be cut differently, the JSON of the two paths isn't spaced alike.
+                if [doc for body in bodies for doc in json.loads(body)["docs"]] != \
+                        [doc for body in expected for doc in json.loads(body)["docs"]]:
+                    print()
+                    raise AssertionError("The readers made different documents from " + csv_file_path)
+                result[name] = seconds
+                print("  %s %8.3f s (%.1fx)" % (name, seconds, result["dict"] / seconds), end="")
+            print()
+            results.append(result)
+    return results
+
+
+def legacy_body(docs):
+    """
+    Makes a `_bulk_docs` body the way the first curl path did, with str() and two passes of replace(). Values
+    holding quotation marks or apostrophes give invalid JSON.
+    """
+    string = str({"docs": docs}).replace("'", "\"").replace('"', '\\"')
+    return ('"' + string + '"').encode()
+
+
+def time_serializer(docs, max_docs, serializer, repeat=3):
+    """
+    Times turning documents into `_bulk_docs` bodies of `max_docs` documents, the best of a few runs.
+
+    Parameters
+    ----------
+    docs : list
+        The documents.
+    max_docs : int
+        Number of documents per body.
+    serializer : str
+        "legacy" for `legacy_body`, otherwise one of db_serialize.SERIALIZERS, with " reused" to build every body in
+        the same buffer.
+    repeat : int
+        (default is 3)
+        Number of runs.
+    Returns
+    -------
+    seconds : float
+        The time of the fastest run.
+    size : int
+        The bytes of all bodies.
+    """
+    best = None
+    for run in range(repeat):
+        size = 0
+        start = time.perf_counter()
+        if serializer == "legacy":
+            for i in range(0, len(docs), max_docs):
+                size += len(legacy_body(docs[i:i + max_docs]))
+        else:
+            bodies = methods.iter_bulk_bodies(docs, sys.maxsize, max_docs, serializer.split()[0],
+                                              reuse=serializer.endswith(" reused"))
+            for body in bodies:
+                size += len(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def run_serializer_benchmark(rows=20000, columns=20, max_docs=methods.BATCH_MAX_DOCS):
+    """
+    Compares the str().replace() bodies of the curl path with the serializers of db_serialize on typed documents.
+
+    Every serializer is also given a document holding quotation marks, and its body is checked to be valid JSON.
+
+    Parameters
+    ----------
+    rows : int
+        (default is 20000)
+        Number of documents.
+    columns : int
+        (default is 20)
+        Number of data fields per document.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Number of documents per body.
+    Returns
+    -------
+    results : dict
+        Seconds taken by each serializer.
+    """
+    docs = make_docs(rows, columns)
+    column_types = types_methods.infer_column_types(docs)
+    docs = [types_methods.convert_document(doc, column_types) for doc in docs]
+    quoted = [{"_id": "2020-01-01 00:00:00", "note": 'valve "B" isn\'t open'}]
+    serializers = ["legacy", "json"]
+    if serialize_methods.orjson is not None:
+        serializers += ["orjson", "orjson reused"]
+    results = {}
+    for serializer in serializers:
+        seconds, size = time_serializer(docs, max_docs, serializer)
+        if serializer == "legacy":
+            body = legacy_body(quoted)
+        else:
+            body = next(methods.iter_bulk_bodies(quoted, serializer=serializer.split()[0]))
+        try:
+            valid = json.loads(body)["docs"] == quoted
+        except ValueError:
+            valid = False
+        results[serializer] = seconds
+        print("%-14s %8.3f s %10.1f MB/s  %.1fx  quotes %s" % (serializer, seconds, size / seconds / 1e6,
+                                                              results["legacy"] / seconds, "ok" if valid else "broken"))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("suite", nargs="?", choices=("transport", "ingest", "reader", "serializer"),
+                        default="transport")
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--columns", type=int, default=None)
+    parser.add_argument("--max-docs", type=int, default=None)
+    parser.add_argument("--uploads", type=int, default=db_module.UPLOADS, help="bodies in flight during the ingest")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the stand-in holds back every answer")
+    parser.add_argument("--no-compress", action="store_true", help="send the bodies of the ingest uncompressed")
+    parser.add_argument("--save", default=None, help="write the ingest results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="fail if the ingest is slower than these saved results")
+    args = parser.parse_args()
+    if args.suite == "transport":
+        run_transport_benchmark(args.rows or 20000, args.columns or 10, args.max_docs or 200)
+    elif args.suite == "reader":
+        run_reader_benchmark(args.rows or 20000, (args.columns,) if args.columns else (10, 100, 300))
+    elif args.suite == "serializer":
+        run_serializer_benchmark(args.rows or 20000, args.columns or 20, args.max_docs or methods.BATCH_MAX_DOCS)
+    else:
+        results = run_ingest_benchmark(args.rows or 100000, args.columns or 20,
+                                       max_docs=args.max_docs or methods.BATCH_MAX_DOCS, uploads=args.uploads,
+                                       latency=args.latency, compress=not args.no_compress)
+        if args.save:
+            with open(args.save, "w") as results_file:
+                json.dump(results, results_file, indent=2)
+        if args.baseline:
+            with open(args.baseline) as baseline_file:
+                regressions = compare_results(results, json.load(baseline_file))
+            for regression in regressions:
+                print("Regression:", regression)
+            sys.exit(1 if regressions else 0)
@@ -0,0 +1,112 @@
+"""
+Overlapping the stages of an ingest with asyncio.
+
+The ingest alternates between work for the processor, reading and serializing the CSV, and waiting for the
+database. `pipeline` runs the two side by side: one thread produces the items, e.g. the `_bulk_docs` bodies of a
+file, into a bounded queue while a few others send them, so body N + 1 is being made while body N is in flight and
+the time of an ingest comes close to that of its slowest stage instead of the sum of all of them. `concurrently`
+runs independent steps, like creating views and uploading data, at the same time.
+
+Blocking functions run in threads driven by an event loop, so the rest of the package, which is synchronous, is used
+as it is.
+"""
+
+import asyncio
+import concurrent.futures
+
+WORKERS = 4
+QUEUE_SIZE = 8
+
+
+async def _run_all(coroutines):
+    # Runs coroutines together and stops them all as soon as one fails.
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+async def pipeline(items, function, workers=WORKERS, queue_size=QUEUE_SIZE):
+    """
+    Calls a function on every item of an iterable while the next items are being produced.
+
+    Parameters
+    ----------
+    items : iterable
+        The items, typically a generator doing the processor's share of the work. It's advanced in a thread of its
+        own.
+    function : function
+        Called on every item in one of `workers` threads, typically sending it to the database.
+    workers : int
+        (default is WORKERS)
+        Number of items handled at the same time.
+    queue_size : int
+        (default is QUEUE_SIZE)
+        Number of items produced ahead of the workers, which bounds the memory used.
+    Returns
+    -------
+    results : list
+        What the function returned for every item, in the order of the items.
+    Throws
+    -----
+    Exception
+        Whatever the iterable or the function raised first. The other items are abandoned.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(queue_size)
+    iterator = iter(items)
+    end = object()
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(1) as producer, \
+            concurrent.futures.ThreadPoolExecutor(workers) as consumers:
+
+        async def produce():
+            while True:
+                item = await loop.run_in_executor(producer, next, iterator, end)
+                if item is end:
+                    break
+                results.append(None)
+                await queue.put((len(results) - 1, item))
+            for worker in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                position, item = entry
+                results[position] = await loop.run_in_executor(consumers, function, item)
+
+        await _run_all([produce()] + [consume() for worker in range(workers)])
+    return results
+
+
+async def concurrently(*functions):
+    """
+    Calls functions without arguments at the same time, each in a thread of its own.
+
+    Returns
+    -------
+    results : list
+        What every function returned, in the order of the functions.
+    Throws
+    -----
+    Exception
+        Whatever a function raised first.
+    """
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max(len(functions), 1)) as threads:
+        return await _run_all([loop.run_in_executor(threads, function) for function in functions])
+
+
+def run(coroutine):
+    """
+    Runs a coroutine of this module to its end from synchronous code, e.g. `run(pipeline(items, function))`.
+    """
+    return asyncio.run(coroutine)
@@ -0,0 +1,204 @@
+"""
+Bucketed storage: many rows of a CSV packed into one document.
+
+Instead of one document per row, the rows falling in the same window of time, e.g. ten minutes, are stored together
+with one array per column:
+
+    {"_id": "2020-08-01 00:10:00", "bucket": true, "timestamp": "2020-08-01 00:10:00", "seconds": 600,
+     "offsets": [0, 1, 2, ...], "temperature": [21.5, 21.6, 21.5, ...], ...}
+
+"offsets" holds the seconds of every row since the start of the window. Windows start at a multiple of their length
+since midnight, so a bucket always gets the same id no matter which file its rows came from. A single view,
+_design/buckets/_view/by_start, lists the buckets by the start of their window; `db_query.query_buckets` reads it
+and unpacks the arrays.
+"""
+
+import datetime
+import json
+
+import db_ids as ids_methods
+
+BUCKET_SECONDS = 600
+BUCKET_DESIGN = "buckets"
+BUCKET_VIEW = "by_start"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Fields every bucket has besides its "_id" and "timestamp", which can't be the names of columns.
+BUCKET_FIELDS = ("bucket", "seconds", "offsets")
+
+
+def window_start(timestamp, seconds=BUCKET_SECONDS):
+    """
+    Returns the start of the window a timestamp falls in.
+
+    Parameters
+    ----------
+    timestamp : datetime
+        The timestamp of a row.
+    seconds : int
+        (default is BUCKET_SECONDS)
+        Length of the windows. Lengths that divide a day keep the windows aligned from one day to the next.
+    Returns
+    -------
+    datetime
+        The start of the window.
+    """
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = int((timestamp - midnight).total_seconds())
+    return midnight + datetime.timedelta(seconds=elapsed - elapsed % seconds)
+
+
+def _new_bucket(start, seconds, make_id):
+    text = start.strftime(TIMESTAMP_FORMAT)
+    return {"_id": make_id(text), "bucket": True, "timestamp": text, "seconds": seconds, "offsets": []}
+
+
+def iter_bucket_documents(docs, seconds=BUCKET_SECONDS, id_scheme="timestamp", source=None):
+    """
+    Packs the documents of consecutive rows into one bucket per window of time.
+
+    Parameters
+    ----------
+    docs : iterable
+        The documents of the rows, in the order of time, e.g. from `db_methods.iter_csv_file`.
+    seconds : int
+        (default is BUCKET_SECONDS)
+        Length of the windows.
+    id_scheme : str
+        (default is "timestamp")
+        How the id of a bucket is made from the start of its window, one of db_ids.ID_SCHEMES.
+    source : str
+        (default is None)
+        Name of the instrument prefixing the ids.
+    Yields
+    ------
+    bucket : dict
+        One document per window. A column missing from a row holds None at its position.
+    Throws
+    -----
+    ValueError
+        A timestamp isn't in ISO 8601 format, or a column has the name of a field of buckets, see BUCKET_FIELDS.
+    Notes
+    -----
+    Rows that go back to an earlier window start a new bucket with the id of that window, which then conflicts with
+    the first one. See `merge_buckets` for how such buckets are put together.
+    """
+    make_id = ids_methods.id_maker(id_scheme, source)
+    bucket = None
+    start = None
+    rows = 0
+    for doc in docs:
+        timestamp = ids_methods.parse_timestamp(doc["timestamp"])
+        if bucket is None or not start <= timestamp < start + datetime.timedelta(seconds=seconds):
+            if bucket is not None:
+                yield bucket
+            start = window_start(timestamp, seconds)
+            bucket = _new_bucket(start, seconds, make_id)
+            rows = 0
+        offset = (timestamp - start).total_seconds()
+        bucket["offsets"].append(int(offset) if offset.is_integer() else offset)
+        for header, value in doc.items():
+            if header in ("_id", "timestamp"):
+                continue
+            if header in BUCKET_FIELDS:
+                raise ValueError("The column " + repr(header) + " has the name of a field of buckets")
+            column = bucket.get(header)
+            if column is None:
+                column = bucket[header] = [None] * rows
+            column.append(value)
+        rows += 1
+        for header, column in bucket.items():
+            if isinstance(column, list) and len(column) < rows:
+                column.append(None)
+    if bucket is not None:
+        yield bucket
+
+
+def columns_of(bucket):
+    """
+    Returns the names of the columns of a bucket.
+    """
+    return [key for key, value in bucket.items() if isinstance(value, list) and key != "offsets"]
+
+
+def iter_bucket_rows(bucket):
+    """
+    Unpacks a bucket into the documents of its rows, the way they were before `iter_bucket_documents`.
+
+    Parameters
+    ----------
+    bucket : dict
+        The bucket.
+    Yields
+    ------
+    doc : dict
+        The "timestamp" and the value of every column of one row.
+    """
+    start = ids_methods.parse_timestamp(bucket["timestamp"])
+    columns = columns_of(bucket)
+    for position, offset in enumerate(bucket["offsets"]):
+        doc = {"timestamp": (start + datetime.timedelta(seconds=offset)).isoformat(sep=" ")}
+        for column in columns:
+            doc[column] = bucket[column][position]
+        yield doc
+
+
+def merge_buckets(existing, bucket):
+    """
+    Puts the rows of two buckets of the same window together.
+
+    Parameters
+    ----------
+    existing : dict
+        The bucket stored in the database.
+    bucket : dict
+        The new bucket. Its values replace those of rows with the same offset.
+    Returns
+    -------
+    merged : dict
+        The bucket holding the rows of both, in the order of time, with the `_rev` of `existing`.
+    """
+    rows = {}
+    for part in (existing, bucket):
+        columns = columns_of(part)
+        for position, offset in enumerate(part["offsets"]):
+            row = rows.setdefault(offset, {})
+            for column in columns:
+                value = part[column][position]
+                if value is not None or column not in row:
+                    row[column] = value
+    merged = {key: value for key, value in existing.items() if not isinstance(value, list)}
+    offsets = sorted(rows)
+    merged["offsets"] = offsets
+    for column in set(columns_of(existing)) | set(columns_of(bucket)):
+        merged[column] = [rows[offset].get(column) for offset in offsets]
+    return merged
+
+
+def bucket_design_document():
+    """
+    Returns the design document listing the buckets by the start of their window.
+
+    Returns
+    -------
+    document : dict
+        The design document, holding the view BUCKET_VIEW. Its key is the start of the window and its value the
+        number of rows of the bucket.
+    """
+    view_func = "function(doc) {if (doc.bucket && doc.offsets) emit(doc.timestamp, doc.offsets.length)}"
+    return {"views": {BUCKET_VIEW: {"map": view_func}}, "language": "javascript"}
+
+
+def bucket_view_request(database):
+    """
+    Builds the request creating the design document of the buckets.
+
+    Parameters
+    ----------
+    database : str
+        Name of the database.
+    Returns
+    -------
+    request : tuple
+        The (method, path, body) of the HTTP request.
+    """
+    return "PUT", "/" + database + "/_design/" + BUCKET_DESIGN, json.dumps(bucket_design_document()).encode()
@@ -0,0 +1,94 @@
+"""
+Local cache of the views known to exist in every database.
+
+Headers whose views are in the cache need no request to the database before their data is recorded. The cache is
+kept in memory for long running processes and in a JSON file in the project folder between runs.
+"""
+
+import json
+import os
+import threading
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "view_cache.json")
+
+_views = {}
+_loaded = False
+_lock = threading.Lock()
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    try:
+        with open(CACHE_FILE) as cache_file:
+            for database, views in json.load(cache_file).items():
+                _views[database] = set(views)
+    except (OSError, ValueError):
+        pass
+    _loaded = True
+
+
+def _save():
+    temporary_path = CACHE_FILE + ".tmp"
+    try:
+        with open(temporary_path, "w") as cache_file:
+            json.dump({database: sorted(views) for database, views in _views.items()}, cache_file)
+        os.replace(temporary_path, CACHE_FILE)
+    except OSError as error:
+        print("The view cache couldn't be saved:", error)
+
+
+def known_views(database):
+    """
+    Returns the views known to exist in a database.
+
+    Parameters
+    ----------
+    database : str
+        The name of the database.
+    Returns
+    -------
+    views : set
+        The headers that have views. The set is empty if nothing is known about the database.
+    """
+    with _lock:
+        _load()
+        return set(_views.get(database, ()))
+
+
+def remember_views(database, views):
+    """
+    Adds views to the cache of a database.
+
+    Parameters
+    ----------
+    database : str
+        The name of the database.
+    views : iterable
+        Headers that have views.
+    """
+    views = set(views)
+    with _lock:
+        _load()
+        known = _views.setdefault(database, set())
+        if not known.issuperset(views):
+            known.update(views)
+            _save()
+
+
+def forget_views(database):
+    """
+    Empties the cache of a database, so that its views are read from the database next time.
+
+    This is done whenever creating a view fails or conflicts, since the cache no longer matches the database.
+
+    Parameters
+    ----------
+    database : str
+        The name of the database.
+    """
+    with _lock:
+        _load()
+        if _views.pop(database, None) is not None:
+            _save()
@@ -0,0 +1,226 @@
+"""
+Local columnar cache of the data read from the database.
+
+The (timestamps, values) arrays of every column read over a range of time are saved as .npy files in the project
+folder. Reading the same column again, over the same range or a part of it, maps the files into memory instead of
+asking the database. The least recently used ranges are deleted once the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import db_query as query_methods
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "column_cache")
+CACHE_MAX_BYTES = 1 << 30
+INDEX_FILE = "index.json"
+
+
+class ColumnCache:
+    """
+    Arrays of columns over ranges of time, kept on disk and evicted by least recent use.
+
+    Parameters
+    ----------
+    directory : str
+        (default is CACHE_DIRECTORY)
+        Where the arrays are saved.
+    max_bytes : int
+        (default is CACHE_MAX_BYTES)
+        Largest size of the arrays on disk.
+    Notes
+    -----
+    A cached range is never read from the database again, so ranges that are still being recorded shouldn't be
+    cached.
+    """
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(os.path.join(directory, INDEX_FILE)) as index_file:
+                self.index = json.load(index_file)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _save_index(self):
+        temporary_path = os.path.join(self.directory, INDEX_FILE + ".tmp")
+        with open(temporary_path, "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temporary_path, os.path.join(self.directory, INDEX_FILE))
+
+    def _path(self, name, part):
+        return os.path.join(self.directory, name + "." + part + ".npy")
+
+    def get(self, database, column, start, end):
+        """
+        Returns the arrays of a column over a range of time, if a cached range covers it.
+
+        Parameters
+        ----------
+        database : str
+            The name of the database.
+        column : str
+            The header.
+        start : str, datetime or numpy.datetime64
+            Beginning of the range.
+        end : str, datetime or numpy.datetime64
+            End of the range, included.
+        Returns
+        -------
+        data : tuple
+            The (timestamps, values) arrays, mapped into memory from the cache. None if no cached range covers the
+            range.
+        """
+        start = query_methods.format_timestamp(start)
+        end = query_methods.format_timestamp(end)
+        with self.lock:
+            for name, entry in self.index.items():
+                if entry["database"] == database and entry["column"] == column and \
+                        entry["start"] <= start and end <= entry["end"]:
+                    break
+            else:
+                return None
+            entry["used"] = time.time()
+            self._save_index()
+        try:
+            timestamps = np.load(self._path(name, "timestamps"), mmap_mode="r")
+            values = np.load(self._path(name, "values"), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if entry["start"] == start and entry["end"] == end:
+            return timestamps, values
+        lower = np.searchsorted(timestamps, np.datetime64(start.replace(" ", "T")), side="left")
+        upper = np.searchsorted(timestamps, np.datetime64(end.replace(" ", "T")), side="right")
+        return timestamps[lower:upper], values[lower:upper]
+
+    def put(self, database, column, start, end, timestamps, values):
+        """
+        Saves the arrays of a column over a range of time, then evicts old ranges until the cache fits.
+
+        Parameters
+        ----------
+        database : str
+            The name of the database.
+        column : str
+            The header.
+        start : str, datetime or numpy.datetime64
+            Beginning of the range.
+        end : str, datetime or numpy.datetime64
+            End of the range, included.
+        timestamps : numpy.ndarray
+            The timestamps, in increasing order.
+        values : numpy.ndarray
+            The values.
+        """
+        start = query_methods.format_timestamp(start)
+        end = query_methods.format_timestamp(end)
+        name = hashlib.sha1("\0".join((database, column, start, end)).encode()).hexdigest()
+        np.save(self._path(name, "timestamps"), timestamps)
+        np.save(self._path(name, "values"), values)
+        size = os.path.getsize(self._path(name, "timestamps")) + os.path.getsize(self._path(name, "values"))
+        with self.lock:
+            self.index[name] = {"database": database, "column": column, "start": start, "end": end,
+                                "bytes": size, "used": time.time()}
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        total = sum(entry["bytes"] for entry in self.index.values())
+        for name in sorted(self.index, key=lambda name: self.index[name]["used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(name)["bytes"]
+            for part in ("timestamps", "values"):
+                try:
+                    os.remove(self._path(name, part))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        """
+        Deletes every cached range.
+        """
+        with self.lock:
+            max_bytes = self.max_bytes
+            self.max_bytes = -1
+            self._evict()
+            self.max_bytes = max_bytes
+            self._save_index()
+
+
+def cached_columns(cache, database, columns, start, end):
+    """
+    Returns the cached arrays of columns over a range of time, see `ColumnCache.get`.
+
+    Parameters
+    ----------
+    cache : ColumnCache
+        The cache.
+    database : str
+        The name of the database.
+    columns : str or list
+        The header, or headers.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) arrays of every column found in the cache.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    data = {}
+    for column in columns:
+        arrays = cache.get(database, column, start, end)
+        if arrays is not None:
+            data[column] = arrays
+    return data
+
+
+def query_columns_cached(transport, database, columns, start, end, cache, **options):
+    """
+    Returns the values of one or more columns over a range of time, from the cache when possible.
+
+    Columns that aren't cached are read with `db_query.query_columns` and added to the cache.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    cache : ColumnCache
+        The cache.
+    **options
+        Passed on to `db_query.query_columns`, e.g. page_size.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) arrays of every column.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    data = cached_columns(cache, database, columns, start, end)
+    missing = [column for column in columns if column not in data]
+    if missing:
+        for column, (timestamps, values) in query_methods.query_columns(transport, database, missing, start, end,
+                                                                        **options).items():
+            cache.put(database, column, start, end, timestamps, values)
+            data[column] = (timestamps, values)
+    return data
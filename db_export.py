@@ -0,0 +1,235 @@
+"""
+Bulk export of the database to Parquet or Feather files for analysis.
+
+Every column is read page by page from its view and written to one file per day (or month) of data,
+<directory>/<column>/<yyyy-mm-dd>.parquet, holding a "timestamp" and a "value" column. Only one page and one
+partition are held in memory at a time, however large the database.
+
+Writing the files needs pyarrow, which isn't required by the rest of the package.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import paramiko
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import db_methods as methods
+import db_module
+import db_query as query_methods
+import db_transport as transport_methods
+
+FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+PARTITIONS = {"day": "datetime64[D]", "month": "datetime64[M]"}
+# Keys every timestamp sorts between, for exports without a range.
+FIRST_KEY = "0000"
+LAST_KEY = "9999"
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Exporting needs pyarrow, install it with: pip install pyarrow")
+
+
+def write_partition(path, timestamps, values, file_format="parquet"):
+    """
+    Writes the data of one column over one partition of time.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file.
+    timestamps : numpy.ndarray
+        The timestamps, as datetime64.
+    values : numpy.ndarray
+        The values, as float64.
+    file_format : str
+        (default is "parquet")
+        "parquet" or "feather".
+    Throws
+    -----
+    ImportError
+        pyarrow isn't installed.
+    """
+    _require_pyarrow()
+    table = pyarrow.table({"timestamp": pyarrow.array(timestamps), "value": pyarrow.array(values)})
+    temporary_path = path + ".tmp"
+    if file_format == "feather":
+        pyarrow.feather.write_feather(table, temporary_path)
+    else:
+        pyarrow.parquet.write_table(table, temporary_path)
+    os.replace(temporary_path, path)
+
+
+def export_column(transport, database, column, location, directory, start=FIRST_KEY, end=LAST_KEY,
+                  file_format="parquet", partition="day", page_size=query_methods.PAGE_SIZE):
+    """
+    Streams one column into partitioned files.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    column : str
+        The header.
+    location : tuple
+        The (design document name, view name) of its view, from `db_methods.view_locations`.
+    directory : str
+        The directory of the export. The files go in a folder named after the column.
+    start : str
+        (default is FIRST_KEY)
+        Beginning of the range.
+    end : str
+        (default is LAST_KEY)
+        End of the range, included.
+    file_format : str
+        (default is "parquet")
+        One of FORMATS.
+    partition : str
+        (default is "day")
+        One of PARTITIONS.
+    page_size : int
+        (default is db_query.PAGE_SIZE)
+        Number of rows per request.
+    Returns
+    -------
+    files : list
+        Paths of the files written.
+    """
+    column_directory = os.path.join(directory, column)
+    os.makedirs(column_directory, exist_ok=True)
+    files = []
+    current = None
+    timestamps = []
+    values = []
+
+    def flush():
+        if timestamps:
+            path = os.path.join(column_directory, str(current) + FORMATS[file_format])
+            write_partition(path, np.concatenate(timestamps), np.concatenate(values), file_format)
+            files.append(path)
+
+    path = query_methods.view_path(database, location)
+    for rows in query_methods.iter_view_pages(transport, path, start, end, page_size):
+        page_timestamps, page_values = query_methods.rows_to_arrays(rows)
+        periods = page_timestamps.astype(PARTITIONS[partition])
+        # Rows come sorted by time, so a page is cut where its partition changes.
+        cuts = np.flatnonzero(periods[1:] != periods[:-1]) + 1
+        for lower, upper in zip(np.concatenate(([0], cuts)), np.concatenate((cuts, [len(periods)]))):
+            if lower == upper:
+                continue
+            if periods[lower] != current:
+                flush()
+                current = periods[lower]
+                timestamps = []
+                values = []
+            timestamps.append(page_timestamps[lower:upper])
+            values.append(page_values[lower:upper])
+    flush()
+    return files
+
+
+def export_database(transport, database, directory, columns=None, start=None, end=None, file_format="parquet",
+                    partition="day"):
+    """
+    Exports columns of a database, over a range of time or all of it, into partitioned files.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    directory : str
+        The directory of the export.
+    columns : list
+        (default is None)
+        The headers to export, every header with a view when None.
+    start : str, datetime or numpy.datetime64
+        (default is None)
+        Beginning of the range, the first data when None.
+    end : str, datetime or numpy.datetime64
+        (default is None)
+        End of the range, included, the last data when None.
+    file_format : str
+        (default is "parquet")
+        One of FORMATS.
+    partition : str
+        (default is "day")
+        One of PARTITIONS.
+    Returns
+    -------
+    files : dict
+        The paths of the files written for every column.
+    Throws
+    -----
+    ImportError
+        pyarrow isn't installed.
+    ValueError
+        The format or partition isn't known.
+    """
+    _require_pyarrow()
+    if file_format not in FORMATS or partition not in PARTITIONS:
+        raise ValueError("Unknown format or partition: " + str(file_format) + ", " + str(partition))
+    locations = methods.view_locations(methods.return_design_documents(transport, database))
+    if columns is None:
+        columns = sorted(column for column in locations if column != "timestamp")
+    start = FIRST_KEY if start is None else query_methods.format_timestamp(start)
+    end = LAST_KEY if end is None else query_methods.format_timestamp(end)
+    files = {}
+    for column in columns:
+        files[column] = export_column(transport, database, column, locations.get(column, (column, "show_specs")),
+                                      directory, start, end, file_format, partition)
+        print(column, len(files[column]), "files written")
+    return files
+
+
+def export_data(database_name, directory, **options):
+    """
+    Exports a database into partitioned Parquet or Feather files, see `export_database`.
+
+    Parameters
+    ----------
+    database_name : str
+        Name of the database.
+    directory : str
+        The directory of the export.
+    **options
+        Passed on to `export_database`, e.g. columns, start, end or file_format.
+    Returns
+    -------
+    files : dict
+        The paths of the files written for every column. One is returned if the database couldn't be reached.
+    """
+    try:
+        ssh = db_module.ssh_connect()
+        transport = transport_methods.connect(ssh)
+        files = export_database(transport, database_name.lower(), directory, **options)
+        transport.close()
+        db_module.ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return files
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exports a database into partitioned Parquet or Feather files.")
+    parser.add_argument("database")
+    parser.add_argument("directory")
+    parser.add_argument("--columns", nargs="+", default=None)
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--partition", choices=sorted(PARTITIONS), default="day")
+    args = parser.parse_args()
+    export_data(args.database, args.directory, columns=args.columns, start=args.start, end=args.end,
+                file_format=args.format, partition=args.partition)
@@ -0,0 +1,156 @@
+"""
+Document ids built from the timestamp of a row.
+
+The "timestamp" scheme uses the timestamp as it's written in the CSV, e.g. '2020-08-01 00:00:00', which is how the
+database was filled so far. The "compact" scheme uses the number of microseconds since 1970 as 14 hexadecimal
+digits, e.g. '05abd4e1c9a000', which is less than half as long, keeps sub-second timestamps apart and sorts in the
+order of time, so new documents are always appended at the end of the database's B-tree.
+
+Either scheme can be prefixed with the name of the instrument the data comes from, e.g. 'tpc:05abd4e1c9a000', so
+that several instruments logging at the same second write to one database without conflicts.
+"""
+
+import datetime
+
+ID_SCHEMES = ("timestamp", "compact")
+SEPARATOR = ":"
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def check_source(source):
+    """
+    Makes sure the name of a source can prefix document ids.
+
+    Parameters
+    ----------
+    source : str
+        The name of the instrument, None for no prefix.
+    Throws
+    -----
+    ValueError
+        The name doesn't start with a letter or contains the separator. Timestamps start with a digit, which is how
+        prefixed ids are told apart from the others.
+    """
+    if source is None:
+        return
+    if not _is_source(source):
+        raise ValueError("A source must start with a letter and can't contain '" + SEPARATOR + "': " + repr(source))
+
+
+def parse_timestamp(timestamp):
+    """
+    Reads a timestamp as it's written in the CSV.
+
+    Parameters
+    ----------
+    timestamp : str
+        The timestamp, e.g. '2020-08-01 00:00:00' or '2020-08-01T00:00:00.250'.
+    Returns
+    -------
+    datetime
+        The timestamp, in UTC if it had a time zone.
+    Throws
+    -----
+    ValueError
+        The timestamp isn't in ISO 8601 format.
+    """
+    value = datetime.datetime.fromisoformat(timestamp.strip())
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def compact_id(timestamp):
+    """
+    Returns the compact id of a timestamp, its microseconds since 1970 as 14 hexadecimal digits.
+
+    Parameters
+    ----------
+    timestamp : str
+        The timestamp, see `parse_timestamp`.
+    Returns
+    -------
+    str
+        The id.
+    """
+    return "%014x" % ((parse_timestamp(timestamp) - EPOCH) // MICROSECOND)
+
+
+def id_maker(scheme="timestamp", source=None):
+    """
+    Returns the function giving the id of a document from its timestamp.
+
+    Parameters
+    ----------
+    scheme : str
+        (default is "timestamp")
+        One of ID_SCHEMES.
+    source : str
+        (default is None)
+        The name of the instrument prefixing every id, see `check_source`.
+    Returns
+    -------
+    function
+        Takes the timestamp of a row and returns the id of its document.
+    Throws
+    -----
+    ValueError
+        The scheme or source isn't valid.
+    """
+    if scheme not in ID_SCHEMES:
+        raise ValueError("Unknown id scheme: " + str(scheme))
+    check_source(source)
+    prefix = "" if source is None else source + SEPARATOR
+    if scheme == "compact":
+        return lambda timestamp: prefix + compact_id(timestamp)
+    if prefix == "":
+        return lambda timestamp: timestamp
+    return lambda timestamp: prefix + timestamp
+
+
+def split_id(doc_id):
+    """
+    Splits a document id into its source and the rest.
+
+    Parameters
+    ----------
+    doc_id : str
+        The id of a document.
+    Returns
+    -------
+    source : str
+        The name of the instrument, None if the id has no prefix.
+    key : str
+        The timestamp or compact id.
+    """
+    source, separator, key = doc_id.partition(SEPARATOR)
+    if separator == "" or not _is_source(source):
+        return None, doc_id
+    return source, key
+
+
+def _is_source(text):
+    return text[:1].isalpha() and SEPARATOR not in text
+
+
+def timestamp_of(doc_id):
+    """
+    Returns the timestamp a document id was made from.
+
+    Parameters
+    ----------
+    doc_id : str
+        The id of a document, in either scheme.
+    Returns
+    -------
+    datetime or str
+        The timestamp of a compact id, the key itself for the "timestamp" scheme.
+    """
+    key = split_id(doc_id)[1]
+    if len(key) == 14:
+        try:
+            return EPOCH + int(key, 16) * MICROSECOND
+        except ValueError:
+            pass
+    return key
@@ -0,0 +1,452 @@
+"""
+Recording many CSV files at once.
+
+The files are parsed and serialized across a pool of processes, and the request bodies are uploaded over a bounded
+number of keep-alive connections shared by all files. The bodies of a file are handed to the parent as they are
+made and uploaded while the rest of the file is read, so neither side holds more than a few bodies of it.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import multiprocessing
+import os
+import threading
+
+import paramiko
+
+import db_columnar as columnar_methods
+import db_ids as ids_methods
+import db_journal as journal_methods
+import db_metrics as metrics_methods
+import db_methods as methods
+import db_module
+import db_serialize as serialize_methods
+import db_transport as transport_methods
+import db_validate as validate_methods
+
+STATUS = {0: "ok", 1: "conflict", 2: "error"}
+# Status of a file whose data was recorded but some of whose views couldn't be created.
+UNINDEXED = "unindexed"
+CONNECTIONS = 4
+# Bodies of a file read ahead of its upload.
+QUEUED_BODIES = 4
+
+
+def find_csv_files(source):
+    """
+    Returns the CSV files of a directory, or the files matching a glob pattern.
+
+    Parameters
+    ----------
+    source : str
+        A directory, e.g. 'dumps', or a pattern, e.g. 'dumps/*.csv'.
+    Returns
+    -------
+    paths : list
+        The sorted paths of the files. Files already renamed to *_conflict.csv are left out.
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, "*.csv")
+    return sorted(path for path in glob.glob(source) if not path.endswith("_conflict.csv"))
+
+
+def prepare_file(csv_file_path, max_bytes=methods.BATCH_MAX_BYTES, max_docs=methods.BATCH_MAX_DOCS,
+                 infer_types=True, schema=None, id_scheme="timestamp", source=None, bucket_seconds=None, reader="dict",
+                 serializer=None, validate=True):
+    """
+    Reads a CSV file and serializes its rows into `_bulk_docs` bodies, one body at a time.
+
+    The file is checked and its column types are inferred right away, the bodies are made as they are asked for.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the size of each body.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents in each body.
+    infer_types : bool
+        (default is True)
+        Writes typed values, see `db_types`.
+    schema : dict
+        (default is None)
+        Column types that override the inferred ones.
+    id_scheme : str
+        (default is "timestamp")
+        How document ids are made from the timestamp, one of db_ids.ID_SCHEMES.
+    source : str
+        (default is None)
+        Name of the instrument prefixing every id.
+    bucket_seconds : int
+        (default is None)
+        Packs the rows of every window of that many seconds into one document, see `db_buckets`.
+    reader : str
+        (default is "dict")
+        "columnar" reads the file column-wise, which is faster for wide files, see `db_columnar`. Buckets are
+        always made from the rows read one by one.
+    serializer : str
+        (default is None)
+        How documents are turned into JSON, one of db_serialize.SERIALIZERS. orjson when installed if None.
+    validate : bool
+        (default is True)
+        Checks the file first, see `db_validate`.
+    Returns
+    -------
+    csv_file_path : str
+        Path of the CSV file.
+    headers : list
+        The headings of the CSV, one if the file can't be found.
+    fingerprint : str
+        The fingerprint of the headers found by the check, see `db_validate.header_fingerprint`. None if the file
+        wasn't checked.
+    bodies : generator
+        The serialized bodies, each with the number of documents in it, see `db_module.iter_csv_bodies`.
+    Throws
+    -----
+    ValueError
+        The file is invalid, see `db_validate.check_csv`.
+    csv.Error
+        The file isn't a CSV file that can be read.
+    """
+    headers = methods.read_headers(csv_file_path)
+    if headers == 1:
+        return csv_file_path, 1, None, []
+    fingerprint = None
+    if validate:
+        with metrics_methods.timed("read", items=0):
+            headers, fingerprint = validate_methods.check_csv(csv_file_path)
+    bodies = db_module.iter_csv_bodies(csv_file_path, max_bytes, max_docs, infer_types, schema, id_scheme, source,
+                                       bucket_seconds, reader, serializer)
+    return csv_file_path, headers, fingerprint, bodies
+
+
+def _prepare_in_worker(csv_file_path, bodies_queue, **prepare_options):
+    # The headers with their fingerprint and then every body go through the bounded queue of the file, which blocks
+    # the worker while the upload is behind. None always closes the queue, even if the file couldn't be read. The
+    # metrics of a worker process are sent back with its result, since they can't be seen from the parent.
+    before = metrics_methods.snapshot()
+    try:
+        csv_file_path, headers, fingerprint, bodies = prepare_file(csv_file_path, **prepare_options)
+        bodies_queue.put((headers, fingerprint))
+        for body in bodies:
+            bodies_queue.put(body)
+    finally:
+        bodies_queue.put(None)
+    return metrics_methods.difference(metrics_methods.snapshot(), before)
+
+
+def _upload_from_queue(transport, reconciler, database, bodies_queue, conflict_policy, csv_file_path):
+    # Uploads the bodies of a file as its worker puts them in the queue, see `_prepare_in_worker`.
+    prepared = bodies_queue.get()
+    if prepared is None or prepared[0] == 1:
+        return None if prepared is None else 1, 2, None, 0
+    headers, fingerprint = prepared
+    bodies = iter(bodies_queue.get, None)
+    try:
+        return (headers,) + upload_file(transport, reconciler, database, headers, bodies, conflict_policy,
+                                        csv_file_path, fingerprint)
+    finally:
+        # The rest of the bodies are taken off the queue if the upload stopped, so the worker isn't left blocked.
+        for body in bodies:
+            pass
+
+
+class ViewReconciler:
+    """
+    Makes sure the headers of every file of a run have views, one file at a time.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    grouped_views : bool
+        (default is True)
+        Puts new views in grouped design documents, see `db_methods.create_views_requests`.
+    bucketed : bool
+        (default is False)
+        The files are stored in buckets, which only need the view of the buckets, see `db_buckets`.
+    stats_views : bool
+        (default is True)
+        Also creates the statistics views of the headers, see `db_module.reconcile_stats_views`.
+    """
+
+    def __init__(self, transport, database, grouped_views=True, bucketed=False, stats_views=True):
+        self.transport = transport
+        self.database = database
+        self.grouped_views = grouped_views
+        self.bucketed = bucketed
+        self.stats_views = stats_views
+        self.lock = threading.Lock()
+
+    def reconcile(self, headers, fingerprint=None):
+        """
+        Makes sure every header has a view, see `db_module.reconcile_views`.
+
+        Parameters
+        ----------
+        headers : list
+            The headings of a CSV file.
+        fingerprint : str
+            (default is None)
+            The fingerprint of the headers, see `db_validate.header_fingerprint`.
+        Returns
+        -------
+        :int
+            A nonzero value indicates that some views couldn't be created.
+        """
+        with self.lock:
+            return db_module.reconcile_views(self.transport, self.database, headers, self.grouped_views,
+                                             self.bucketed, self.stats_views, fingerprint)
+
+
+def file_status(result, views_result):
+    """
+    Returns the status of a file once it's uploaded.
+
+    Parameters
+    ----------
+    result : int
+        The error code of the upload, see `upload_file`.
+    views_result : int
+        Nonzero if some views of the file couldn't be created.
+    Returns
+    -------
+    str
+        One of STATUS, or UNINDEXED if the data was recorded, maybe with conflicts, but some views are missing.
+    """
+    if views_result != 0 and result < 2:
+        return UNINDEXED
+    return STATUS[result]
+
+
+def upload_file(transport, reconciler, database, headers, bodies, conflict_policy="report", csv_file_path=None,
+                fingerprint=None, journal_key=None):
+    """
+    Uploads the bodies of one file and makes sure its headers have views.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    reconciler : ViewReconciler
+        Keeps track of the views of the database.
+    database : str
+        The name of the database.
+    headers : list
+        The headings of the CSV file.
+    bodies : iterable
+        The serialized bodies with the number of documents in each, from `prepare_file`.
+    conflict_policy : str
+        (default is "report")
+        What to do with documents already in the database, one of db_methods.CONFLICT_POLICIES.
+    csv_file_path : str
+        (default is None)
+        Path of the CSV file. Its batches are kept in a journal, so an upload that stopped halfway is resumed, see
+        `db_journal`. No journal is kept when None.
+    fingerprint : str
+        (default is None)
+        The fingerprint of the headers from `prepare_file`, worked out again when None.
+    journal_key : str
+        (default is None)
+        Names the part of the file the bodies are from, see `db_journal.IngestJournal`.
+    Returns
+    -------
+    result : int
+        A nonzero value indicates an error code with two signifying catastrophic failure and one signifying a
+        conflict.
+    failed_docs : list
+        The documents that couldn't be recorded, see `db_methods.cleanup_failed_rows`.
+    views_result : int
+        A nonzero value indicates that some views couldn't be created. The data is recorded all the same, and the
+        views are created again with the next file with these headers, see `db_module.reconcile_views`.
+    Throws
+    -----
+    OSError
+        The connection was lost before the upload completed, the file is resumed from its journal.
+    """
+    journal = journal_methods.IngestJournal(csv_file_path, journal_key) if csv_file_path is not None else None
+    try:
+        result, failed_docs = db_module.upload_bodies(transport, database, bodies, conflict_policy, journal)
+    finally:
+        if journal is not None:
+            journal.close()
+    views_result = reconciler.reconcile(headers, fingerprint)
+    if views_result != 0:
+        print("View creation unsuccessful, the data can't be read by some views until they are created.")
+    return result, failed_docs, views_result
+
+
+def ingest_files(transport, database, paths, processes=None, connections=CONNECTIONS, cleanup=True,
+                 grouped_views=True, conflict_policy="report", **prepare_options):
+    """
+    Records the data of many CSV files over an open transport.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB. It should hold at least `connections` connections.
+    database : str
+        The name of the database.
+    paths : list
+        Paths of the CSV files.
+    processes : int
+        (default is None)
+        Number of worker processes parsing the files, one per CPU when None.
+    connections : int
+        (default is CONNECTIONS)
+        Number of files uploaded at the same time.
+    cleanup : bool
+        (default is True)
+        Deletes every file once its data is sent. The rows that couldn't be recorded are written to
+        <file>_conflict.csv, see `db_methods.cleanup_failed_rows`, and invalid files are renamed to *_conflict.csv.
+        Files whose upload was interrupted are left with their journal, so running again resumes them.
+    grouped_views : bool
+        (default is True)
+        Puts new views in grouped design documents.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows already in the database, one of db_methods.CONFLICT_POLICIES.
+    **prepare_options
+        Passed on to `prepare_file`, e.g. max_docs or schema.
+    Returns
+    -------
+    report : dict
+        The status of every file: "ok", "conflict", "error", "missing" or "unindexed", see `file_status`.
+    """
+    report = {}
+    reconciler = ViewReconciler(transport, database, grouped_views, prepare_options.get("bucket_seconds") is not None)
+    # Only a few files are read ahead of their upload, and only a few bodies of each, so memory doesn't grow with the
+    # number or the size of the files. Every file read has a thread taking its bodies, while the transport bounds
+    # the requests in flight to its connections.
+    window = 2 * connections
+    with multiprocessing.Manager() as manager, \
+            concurrent.futures.ProcessPoolExecutor(processes) as parsers, \
+            concurrent.futures.ThreadPoolExecutor(window) as uploaders:
+        uploads = {}
+        remaining = list(paths)
+        while remaining or uploads:
+            while remaining and len(uploads) < window:
+                csv_file_path = remaining.pop(0)
+                bodies_queue = manager.Queue(QUEUED_BODIES)
+                parse = parsers.submit(_prepare_in_worker, csv_file_path, bodies_queue, **prepare_options)
+                upload = uploaders.submit(_upload_from_queue, transport, reconciler, database, bodies_queue,
+                                          conflict_policy, csv_file_path)
+                uploads[upload] = csv_file_path, parse
+            done, not_done = concurrent.futures.wait(list(uploads), return_when=concurrent.futures.FIRST_COMPLETED)
+            for upload in done:
+                _finish(report, *uploads.pop(upload), upload, cleanup)
+    return report
+
+
+def _finish(report, csv_file_path, parse, upload, cleanup):
+    # A file that couldn't be read or sent is reported as an error and left with its journal, so running again
+    # resumes it, unless it's invalid, in which case it's renamed to *_conflict.csv like `db_module` does. One file
+    # failing doesn't stop the others.
+    try:
+        metrics_methods.merge(parse.result())
+    except Exception as error:
+        print("Reading", csv_file_path, "failed:", error)
+        report[csv_file_path] = "error"
+        if cleanup and isinstance(error, (ValueError, csv.Error)):
+            print("CSV renamed to", methods.cleanup_csv(csv_file_path, 2))
+            journal_methods.remove_journal(csv_file_path)
+        metrics_methods.write_log(file=csv_file_path, result="error")
+        return
+    try:
+        headers, result, failed_docs, views_result = upload.result()
+    except Exception as error:
+        print("Upload of", csv_file_path, "failed:", error)
+        report[csv_file_path] = "error"
+        metrics_methods.write_log(file=csv_file_path, result="error")
+        return
+    if headers == 1:
+        report[csv_file_path] = "missing"
+        return
+    report[csv_file_path] = file_status(result, views_result)
+    print(csv_file_path, report[csv_file_path])
+    if cleanup:
+        with metrics_methods.timed("cleanup"):
+            methods.cleanup_failed_rows(csv_file_path, headers, failed_docs)
+            journal_methods.remove_journal(csv_file_path)
+    metrics_methods.write_log(file=csv_file_path, result=report[csv_file_path])
+
+
+def record_data_from_files(database_name, source, processes=None, connections=CONNECTIONS, cleanup=True,
+                           conflict_policy="report", **prepare_options):
+    """
+    Records the data of every CSV file of a directory, or matching a glob pattern, into the database.
+
+    Parameters
+    ----------
+    database_name : str
+        Name of the database.
+    source : str
+        A directory or a glob pattern, see `find_csv_files`.
+    processes : int
+        (default is None)
+        Number of worker processes parsing the files, one per CPU when None.
+    connections : int
+        (default is CONNECTIONS)
+        Number of files uploaded at the same time.
+    cleanup : bool
+        (default is True)
+        Deletes every file once its data is sent, keeping the rows that couldn't be recorded in <file>_conflict.csv.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows already in the database, one of db_methods.CONFLICT_POLICIES.
+    **prepare_options
+        Passed on to `prepare_file`, e.g. max_docs or schema.
+    Returns
+    -------
+    report : dict
+        The status of every file, see `ingest_files`. One is returned if the database couldn't be reached.
+    """
+    paths = find_csv_files(source)
+    if paths == []:
+        print("No CSV files found in", source)
+        return {}
+    name = database_name.lower()
+    try:
+        ssh = db_module.ssh_connect()
+        transport = transport_methods.connect(ssh, pool_size=connections)
+        report = ingest_files(transport, name, paths, processes, connections, cleanup,
+                              conflict_policy=conflict_policy, **prepare_options)
+        transport.close()
+        db_module.ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Records every CSV file of a directory into the database.")
+    parser.add_argument("database")
+    parser.add_argument("source", help="directory or glob pattern of the CSV files")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--connections", type=int, default=CONNECTIONS)
+    parser.add_argument("--keep", action="store_true", help="don't delete or rename the files")
+    parser.add_argument("--conflicts", choices=methods.CONFLICT_POLICIES, default="report",
+                        help="what to do with rows already in the database")
+    parser.add_argument("--ids", choices=ids_methods.ID_SCHEMES, default="timestamp", help="document id scheme")
+    parser.add_argument("--instrument", default=None, help="name of the instrument prefixing the document ids")
+    parser.add_argument("--bucket-seconds", type=int, default=None,
+                        help="pack the rows of every window of that many seconds into one document")
+    parser.add_argument("--reader", choices=columnar_methods.READERS, default="dict",
+                        help="read the files row by row or column-wise, which is faster for wide files")
+    parser.add_argument("--serializer", choices=serialize_methods.SERIALIZERS, default=None,
+                        help="JSON library writing the documents, orjson when it's installed")
+    parser.add_argument("--no-validate", action="store_true", help="don't check the files before sending them")
+    metrics_methods.add_arguments(parser)
+    args = parser.parse_args()
+    metrics_methods.configure(args.metrics_port, args.metrics_log)
+    record_data_from_files(args.database, args.source, args.processes, args.connections, not args.keep,
+                           args.conflicts, id_scheme=args.ids, source=args.instrument,
+                           bucket_seconds=args.bucket_seconds, reader=args.reader, serializer=args.serializer,
+                           validate=not args.no_validate)
@@ -0,0 +1,150 @@
+"""
+Local journal of the batches of a CSV file that reached the database.
+
+The journal is a small SQLite file next to the CSV, <file>.csv.journal. Every batch is marked as sent before its
+request goes out and as done once the answer of the database has been read, so a run that stops halfway, e.g.
+because the SSH connection dropped, is resumed from the first batch that wasn't confirmed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+JOURNAL_SUFFIX = ".journal"
+SENT = "sent"
+DONE = "done"
+
+
+def journal_path(csv_file_path):
+    """
+    Returns the path of the journal of a CSV file, <file>.csv.journal.
+    """
+    return csv_file_path + JOURNAL_SUFFIX
+
+
+def remove_journal(csv_file_path):
+    """
+    Deletes the journal of a CSV file, once the file has been cleaned up.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    """
+    try:
+        os.remove(journal_path(csv_file_path))
+    except FileNotFoundError:
+        pass
+
+
+def _fingerprint(csv_file_path):
+    stat = os.stat(csv_file_path)
+    return str(stat.st_size) + ":" + str(stat.st_mtime_ns)
+
+
+class IngestJournal:
+    """
+    The journal of the batches of one CSV file.
+
+    Batches are told apart by their position in the file and a digest of their body, so a batch only counts as
+    recorded if it's exactly the one that was sent. The journal starts over when the CSV changed since it was
+    written. Its methods can be called from several threads.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    key : str
+        (default is None)
+        Names the part of the file the journal is for, e.g. a chunk of a growing file, see `db_tail`. The journal
+        starts over when the key changes. The size and modification time of the file are the key when None.
+    """
+
+    def __init__(self, csv_file_path, key=None):
+        self.csv_file_path = csv_file_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(journal_path(csv_file_path), check_same_thread=False)
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS file (key TEXT PRIMARY KEY, value TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS batches (number INTEGER PRIMARY KEY, digest TEXT, "
+                                    "docs INTEGER, status TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS failed_docs (number INTEGER, doc TEXT)")
+            fingerprint = _fingerprint(csv_file_path) if key is None else key
+            row = self.connection.execute("SELECT value FROM file WHERE key = 'fingerprint'").fetchone()
+            if row is not None and row[0] != fingerprint:
+                print(csv_file_path, "changed since it was journaled, recording it from the start")
+                self.connection.execute("DELETE FROM batches")
+                self.connection.execute("DELETE FROM failed_docs")
+            self.connection.execute("INSERT OR REPLACE INTO file VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def status(self, number, body):
+        """
+        Returns what is known about a batch.
+
+        Parameters
+        ----------
+        number : int
+            Position of the batch in the file, starting at zero.
+        body : bytes
+            The serialized body of the batch.
+        Returns
+        -------
+        status : str
+            DONE if the answer of the database was read, SENT if the batch was sent without an answer, None if the
+            batch was never sent or has changed since.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT digest, status FROM batches WHERE number = ?",
+                                          (number,)).fetchone()
+        if row is None or row[0] != hashlib.sha1(body).hexdigest():
+            return None
+        return row[1]
+
+    def mark_sent(self, number, body, count):
+        """
+        Marks a batch as sent, just before its request goes out.
+
+        Parameters
+        ----------
+        number : int
+            Position of the batch in the file.
+        body : bytes
+            The serialized body of the batch.
+        count : int
+            Number of documents in the body, as given by `db_methods.iter_json_bodies`.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO batches (number, digest, docs, status) VALUES (?, ?, ?, ?)",
+                                    (number, hashlib.sha1(body).hexdigest(), count, SENT))
+            self.connection.execute("DELETE FROM failed_docs WHERE number = ?", (number,))
+
+    def mark_done(self, number, failed_docs):
+        """
+        Marks a batch as recorded, keeping the documents of the batch that couldn't be.
+
+        Parameters
+        ----------
+        number : int
+            Position of the batch in the file.
+        failed_docs : list
+            The documents of the batch that couldn't be recorded.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE batches SET status = ? WHERE number = ?", (DONE, number))
+            self.connection.executemany("INSERT INTO failed_docs VALUES (?, ?)",
+                                        ((number, json.dumps(doc)) for doc in failed_docs))
+
+    def failed_docs(self):
+        """
+        Returns the documents of every recorded batch that couldn't be recorded, in the order of the file.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT doc FROM failed_docs JOIN batches USING (number) "
+                                           "WHERE status = ? ORDER BY number, failed_docs.rowid", (DONE,)).fetchall()
+        return [json.loads(doc) for doc, in rows]
+
+    def close(self):
+        self.connection.close()
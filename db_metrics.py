@@ -0,0 +1,324 @@
+"""
+Timings and counts of the stages of the ingest.
+
+Every stage of recording a CSV adds up the seconds spent in it, the items that went through it and their bytes:
+
+    read        parsing the CSV into documents, one item per row
+    convert     typing the values and packing buckets, one item per document made
+    serialize   writing the `_bulk_docs` bodies, one item per body
+    transport   sending the bodies and reading the answers of CouchDB, one item per body
+    views       making sure the headers of a file have views, one item per file
+    cleanup     writing the rows that failed and deleting the file, one item per file
+
+Stages that run inside one another, like the generators of a streaming ingest, only count their own time, so the
+seconds of all stages add up to the time of the ingest unless some of them overlap, see `db_async`. Retries and
+failed documents are counted too.
+
+The totals of the process are served in the Prometheus text format by `serve_metrics`, and a line of JSON with what
+changed since the previous line is written after every file once `log_metrics` is called.
+"""
+
+import contextlib
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("read", "convert", "serialize", "transport", "views", "cleanup")
+COUNTERS = ("retries", "failed_documents", "resumed_batches", "compressed_bytes_saved")
+PREFIX = "slowpy_"
+METRICS_PORT = 9464
+# Generators add their totals to the metrics every so many items, so a long file shows up before it's done.
+FLUSH_ITEMS = 1000
+
+_stages = {}
+_counters = {}
+_lock = threading.Lock()
+_local = threading.local()
+_log_file = None
+_logged = None
+
+
+def add(stage, seconds=0.0, items=0, size=0):
+    """
+    Adds to the totals of a stage.
+
+    Parameters
+    ----------
+    stage : str
+        One of STAGES.
+    seconds : float
+        (default is 0.0)
+        Seconds spent in the stage.
+    items : int
+        (default is 0)
+        Number of items that went through it.
+    size : int
+        (default is 0)
+        Their bytes.
+    """
+    with _lock:
+        totals = _stages.setdefault(stage, {"seconds": 0.0, "items": 0, "bytes": 0})
+        totals["seconds"] += seconds
+        totals["items"] += items
+        totals["bytes"] += size
+
+
+def count(counter, value=1):
+    """
+    Adds to a counter, one of COUNTERS.
+    """
+    if value:
+        with _lock:
+            _counters[counter] = _counters.get(counter, 0) + value
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@contextlib.contextmanager
+def timed(stage, items=1, size=0):
+    """
+    Times a block of code as part of a stage, leaving out the stages timed inside it.
+
+    Parameters
+    ----------
+    stage : str
+        One of STAGES.
+    items : int
+        (default is 1)
+        Number of items handled by the block.
+    size : int
+        (default is 0)
+        Their bytes.
+    """
+    stack = _stack()
+    inner = [0.0]
+    stack.append(inner)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        add(stage, elapsed - inner[0], items, size)
+
+
+def iter_timed(stage, iterable, items=None, size=None):
+    """
+    Times the production of every item of an iterable as part of a stage.
+
+    Parameters
+    ----------
+    stage : str
+        One of STAGES.
+    iterable : iterable
+        Typically a generator of the ingest, e.g. `db_methods.iter_csv_file`.
+    items : function
+        (default is None)
+        Gives the number of items of what the iterable yields, one each when None.
+    size : function
+        (default is None)
+        Gives the bytes of what the iterable yields, e.g. len. No bytes are counted when None.
+    Yields
+    ------
+    The items of the iterable.
+    """
+    iterator = iter(iterable)
+    seconds = 0.0
+    produced = 0
+    total_size = 0
+    try:
+        while True:
+            # The generator may be advanced from a different thread every time, see `db_async.pipeline`.
+            stack = _stack()
+            inner = [0.0]
+            stack.append(inner)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                if stack:
+                    stack[-1][0] += elapsed
+                seconds += elapsed - inner[0]
+            produced += 1 if items is None else items(item)
+            if size is not None:
+                total_size += size(item)
+            if produced >= FLUSH_ITEMS:
+                add(stage, seconds, produced, total_size)
+                seconds, produced, total_size = 0.0, 0, 0
+            yield item
+    finally:
+        add(stage, seconds, produced, total_size)
+
+
+def snapshot():
+    """
+    Returns a copy of the totals of this process.
+
+    Returns
+    -------
+    metrics : dict
+        "stages" holds the "seconds", "items" and "bytes" of every stage, "counters" the value of every counter.
+    """
+    with _lock:
+        return {"stages": {stage: dict(totals) for stage, totals in _stages.items()}, "counters": dict(_counters)}
+
+
+def difference(metrics, earlier):
+    """
+    Returns what was added to the totals between two snapshots.
+    """
+    stages = {}
+    for stage, totals in metrics["stages"].items():
+        before = earlier["stages"].get(stage, {})
+        change = {key: value - before.get(key, 0) for key, value in totals.items()}
+        if change["items"] or change["seconds"]:
+            stages[stage] = change
+    counters = {counter: value - earlier["counters"].get(counter, 0) for counter, value in metrics["counters"].items()
+                if value != earlier["counters"].get(counter, 0)}
+    return {"stages": stages, "counters": counters}
+
+
+def merge(metrics):
+    """
+    Adds the totals of another process, e.g. a worker parsing files, to those of this one.
+    """
+    for stage, totals in metrics["stages"].items():
+        add(stage, totals["seconds"], totals["items"], totals["bytes"])
+    for counter, value in metrics["counters"].items():
+        count(counter, value)
+
+
+def prometheus_text():
+    """
+    Returns the totals of this process in the Prometheus text format.
+    """
+    metrics = snapshot()
+    lines = []
+    for key, description in (("seconds", "Seconds spent in each stage of the ingest."),
+                             ("items", "Rows, documents or bodies that went through each stage."),
+                             ("bytes", "Bytes that went through each stage.")):
+        name = PREFIX + "stage_" + key + "_total"
+        lines.append("# HELP " + name + " " + description)
+        lines.append("# TYPE " + name + " counter")
+        for stage in sorted(metrics["stages"]):
+            lines.append('%s{stage="%s"} %s' % (name, stage, repr(metrics["stages"][stage][key])))
+    for counter in COUNTERS:
+        name = PREFIX + counter + "_total"
+        lines.append("# TYPE " + name + " counter")
+        lines.append(name + " " + str(metrics["counters"].get(counter, 0)))
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port=METRICS_PORT, address=""):
+    """
+    Serves the totals of this process at http://<address>:<port>/metrics for Prometheus, from a background thread.
+
+    Parameters
+    ----------
+    port : int
+        (default is METRICS_PORT)
+        The port, zero for any free port.
+    address : str
+        (default is "")
+        The address to listen on, every address when empty.
+    Returns
+    -------
+    server : ThreadingHTTPServer
+        The server, stopped with its shutdown method.
+    """
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Metrics served on port", server.server_address[1])
+    return server
+
+
+def log_metrics(path):
+    """
+    Starts writing the metrics to a JSON-lines file, see `write_log`. None stops it.
+    """
+    global _log_file, _logged
+    with _lock:
+        _log_file = path
+    _logged = snapshot()
+
+
+def write_log(**labels):
+    """
+    Appends a line with what changed in the metrics since the previous line, if `log_metrics` was called.
+
+    Parameters
+    ----------
+    **labels
+        Written in the line as they are, e.g. file="data.csv".
+    """
+    global _logged
+    if _log_file is None:
+        return
+    metrics = snapshot()
+    line = {"time": datetime.datetime.now().isoformat(sep=" ", timespec="seconds")}
+    line.update(labels)
+    line.update(difference(metrics, _logged))
+    _logged = metrics
+    try:
+        with _lock, open(_log_file, "a") as log_file:
+            log_file.write(json.dumps(line) + "\n")
+    except OSError as error:
+        print("The metrics couldn't be logged:", error)
+
+
+def configure(port=None, log_file=None):
+    """
+    Turns on the outputs asked for on the command line of an entry point.
+
+    Parameters
+    ----------
+    port : int
+        (default is None)
+        Serves the metrics on this port, see `serve_metrics`.
+    log_file : str
+        (default is None)
+        Logs the metrics to this file, see `log_metrics`.
+    """
+    if port is not None:
+        serve_metrics(port)
+    if log_file is not None:
+        log_metrics(log_file)
+
+
+def add_arguments(parser):
+    """
+    Adds the --metrics-port and --metrics-log options to the parser of an entry point, see `configure`.
+    """
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-log", default=None, help="append the metrics of every file to this JSON-lines file")
@@ -1,40 +1,67 @@
+import csv
+import functools
 import paramiko
 import json
-import os
 
+import db_async as async_methods
+import db_buckets as buckets_methods
+import db_cache as cache_methods
+import db_columnar as columnar_methods
+import db_columns as columns_methods
+import db_journal as journal_methods
+import db_metrics as metrics_methods
 import db_methods as methods
+import db_query as query_methods
+import db_response as response_methods
+import db_serialize as serialize_methods
+import db_ssh as ssh_methods
+import db_transport as transport_methods
+import db_types as types_methods
+import db_validate as validate_methods
+
+
+ERROR_MESSAGES = {
+    "file_exists": "Document already exists",
+    "conflict": "Conflict with document",
+    "not_found": "Database must be created",
+    "compilation_error": "Check the header names in your CSV file and see if they follow convention",
+}
+RETRIES = 2
+# Number of bodies of a file in flight at the same time, see `upload_bodies`.
+UPLOADS = 4
+# Sets of headers whose views are all made are kept in the view cache under this prefix, see `reconcile_views`.
+SCHEMA_PREFIX = "schema:"
 
 
 # SSH FUNCTIONS
-def ssh_connect(hostname='132.206.126.208', port=2020, username='lolx', password='x3n0ntpc'):
+def ssh_connect(hostname=None, port=None, username=None, password=None):
     """
-    Creates the initial ssh connection to the CouchDB database on the lolx computer using Paramiko.
+    Borrows the ssh connection to the CouchDB database on the lolx computer from the pool of the process.
 
+    The connection is made once per process and kept alive, so back-to-back uploads don't pay a new handshake, see
+    `db_ssh`.
 
     Parameters
     ----------
     hostname : str
-        (default is '132.206.126.208')
-        Address of the host.
+        (default is None)
+        Address of the host, from the environment, slowpy.ini or '132.206.126.208' when None, see `db_ssh.settings`.
     port : int
-        (default is 2020)
-        Port of the host.
+        (default is None)
+        Port of the host, 2020 unless configured otherwise.
     username : str
-        (default is 'lolx')
-        Username to make ssh connection.
+        (default is None)
+        Username to make ssh connection, 'lolx' unless configured otherwise.
     password : str
-        (default is 'x3n0ntpc')
+        (default is None)
         Password to make ssh connection.
 
     Returns
     -------
-    ssh : class
-        SSH instance is returned for later access.
+    ssh : SSHPool
+        Stands in for a paramiko SSHClient, to be given back with `ssh_disconnect`.
     """
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(hostname, port, username, password)
-    return ssh
+    return ssh_methods.shared_pool(hostname, port, username, password)
 
 
 def ssh_execute(ssh, command):
@@ -54,40 +81,71 @@ def ssh_execute(ssh, command):
         but two being catastrophic and program halting.
     """
     stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
-    for line in stdout.readlines():
-        result = json.loads(line)
-        result_key = ""
-        if type(result) == dict:
-            result_key = list(result.keys())[0]
-        if type(result) == list:
-            result_key = list(result[0].keys())[0]
-            result = result[0]
-        if result_key == "ok":
-            return 0
-        if result_key == "error":
-            if result[result_key] == "file_exists":
-                print("Document already exists")
-                return 1
-            if result[result_key] == "conflict":
-                print("Conflict with document")
-                return 1
-            if result[result_key] == "not_found":
-                print("Database must be created")
-                return 1
-            if result[result_key] == "compilation_error":
-                print("Check the header names in your CSV file and see if they follow convention")
-                return 1
-            else:
-                print("Error: ", result[result_key])
-                return 2
+    try:
+        return summary_code(response_methods.summarize_stream(stdout))
+    except ValueError as error:
+        print("An unknown error has occurred: ", error)
+        return 2
+
+
+def result_code(result):
+    """
+    Turns a parsed CouchDB response into the error codes used by this module.
+
+    Parameters
+    ----------
+    result : dict or list
+        The JSON response of CouchDB.
+    Returns
+    -------
+    :int
+        A nonzero value indicates error on a range with one typically being informational and not program halting
+        but two being catastrophic and program halting.
+    """
+    if type(result) != list:
+        result = [result]
+    return summary_code(response_methods.summarize(result))
+
+
+def summary_code(summary):
+    """
+    Turns the summary of a CouchDB response into the error codes used by this module.
+
+    Every kind of error found in the response is printed once, with the number of documents it happened to.
+
+    Parameters
+    ----------
+    summary : dict
+        The summary of the response, from `db_response.summarize`.
+    Returns
+    -------
+    :int
+        A nonzero value indicates error on a range with one typically being informational and not program halting
+        but two being catastrophic and program halting.
+    """
+    if summary.get("skipped"):
+        print(summary["skipped"], "documents already in the database were skipped")
+    if summary["conflict"] == 0 and summary["error"] == 0:
+        return 0
+    code = 1
+    for reason, count in summary["reasons"].items():
+        documents = "" if count == 1 else " (" + str(count) + " documents)"
+        if reason in ERROR_MESSAGES:
+            print(ERROR_MESSAGES[reason] + documents)
         else:
-            print("An unknown error has occurred: ", result)
-            return 2
+            print("Error: ", reason + documents)
+        if reason not in response_methods.INFORMATIONAL_ERRORS:
+            code = 2
+    return code
 
 
-def ssh_disconnect(ssh):
+# HTTP FUNCTIONS
+def http_connect(ssh):
     """
-    Closes SSH instance.
+    Opens the pool of keep-alive HTTP connections to CouchDB.
+
+    CouchDB is reached through a direct-tcpip channel of the SSH connection, or directly when its address is
+    configured, see `db_transport.direct_address`.
 
     Parameters
     ----------
@@ -95,15 +153,363 @@ def ssh_disconnect(ssh):
         SSH instance that provides access to the database
     Returns
     -------
+    transport : CouchTransport
+        The connection pool used by `http_execute`.
+    """
+    return transport_methods.connect(ssh)
+
+
+def http_execute(transport, request):
+    """
+    Sends an HTTP request to CouchDB and interprets the response like `ssh_execute`.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    request : tuple
+        The (method, path, body) of the request, as built by the `*_request` functions of db_methods.
+    Returns
+    -------
+    :int
+        A nonzero value indicates error on a range with one typically being informational and not program halting
+        but two being catastrophic and program halting.
+    """
+    method, path, body = request
+    with transport.stream(method, path, body) as (status, response):
+        try:
+            summary = response_methods.summarize_stream(response)
+        except ValueError as error:
+            print("An unknown error has occurred: ", status, error)
+            return 2
+    return summary_code(summary)
+
+
+def execute_requests(transport, requests):
+    """
+    Sends independent HTTP requests, e.g. the creation of several design documents, at the same time.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB. As many requests as it has connections are in flight at once.
+    requests : list
+        The (method, path, body) of every request.
+    Returns
+    -------
+    :int
+        The highest error code of the requests, see `http_execute`.
+    """
+    if len(requests) < 2:
+        return max([http_execute(transport, request) for request in requests], default=0)
+    results = async_methods.run(async_methods.pipeline(requests, functools.partial(http_execute, transport),
+                                                       transport.pool_size))
+    return max(results)
+
+
+def ssh_disconnect(ssh):
+    """
+    Gives back an ssh connection borrowed with `ssh_connect`.
+
+    The connections of the pool stay open for the next caller and are closed when the process ends. A paramiko
+    SSHClient made some other way is closed.
+
+    Parameters
+    ----------
+    ssh : SSHPool or SSHClient
+        The connection.
+    Returns
+    -------
     :int
-        A zero value indicates task completion.
+        Zero.
     """
-    ssh.close()
+    if not isinstance(ssh, ssh_methods.SSHPool):
+        ssh.close()
     return 0
 
 
+def bulk_execute(transport, database_name, body, retries=RETRIES, conflict_policy="report"):
+    """
+    Sends a `_bulk_docs` body to CouchDB and sends again only the documents that failed.
+
+    Documents that conflict are handled according to `conflict_policy`, see `resolve_conflicts`. With the default
+    policy they are only reported, since sending the same document again would conflict again.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    body : bytes or bytearray
+        The serialized body, from `db_methods.iter_bulk_bodies`.
+    retries : int
+        (default is RETRIES)
+        Number of times failed documents are sent again.
+    conflict_policy : str
+        (default is "report")
+        One of db_methods.CONFLICT_POLICIES.
+    Returns
+    -------
+    summary : dict
+        The outcome of every document, see `db_response.summarize`. Use `summary_code` for an error code.
+        "failed_docs" holds the documents that still conflict or failed.
+    """
+    all_docs = None
+    summary = None
+    for attempt in range(retries + 1):
+        method, path, body = methods.bulk_docs_request(body, database_name)
+        with transport.stream(method, path, body) as (status, response):
+            try:
+                attempt_summary = response_methods.summarize_stream(response)
+            except ValueError:
+                attempt_summary = None
+        if attempt_summary is None:
+            # An answer that isn't JSON says nothing about single documents, so they all count as failed.
+            ids = [doc.get("_id") for doc in json.loads(body)["docs"]]
+            attempt_summary = response_methods.summarize({"id": doc_id, "error": "unknown_error"} for doc_id in ids)
+        summary = attempt_summary if summary is None else _merge_summaries(summary, attempt_summary)
+        if all_docs is None and (summary["conflict_ids"] or summary["error_ids"]):
+            all_docs = json.loads(body)["docs"]
+        if attempt == retries or summary["error_ids"] == []:
+            break
+        failed = set(summary["error_ids"])
+        docs = [doc for doc in json.loads(body)["docs"] if doc.get("_id") in failed]
+        if docs == []:
+            break
+        print("Sending", len(docs), "failed documents again")
+        metrics_methods.count("retries")
+        body = serialize_methods.dumps({"docs": docs})
+    if conflict_policy != "report" and summary["conflict_ids"]:
+        conflicting = set(summary["conflict_ids"])
+        docs = [doc for doc in all_docs if doc.get("_id") in conflicting]
+        summary = _resolved_summary(summary, resolve_conflicts(transport, database_name, docs, conflict_policy,
+                                                               retries))
+    failed = set(summary["conflict_ids"]) | set(summary["error_ids"])
+    summary["failed_docs"] = [doc for doc in all_docs if doc.get("_id") in failed] if failed else []
+    return summary
+
+
+def send_body(transport, database_name, number, body, count, conflict_policy="report", journal=None):
+    """
+    Sends one `_bulk_docs` body of a file, unless its journal says it's already recorded.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    number : int
+        Position of the body in the file, starting at zero.
+    body : bytes or bytearray
+        The serialized body.
+    count : int
+        Number of documents in the body.
+    conflict_policy : str
+        (default is "report")
+        What to do with documents already in the database, one of db_methods.CONFLICT_POLICIES.
+    journal : IngestJournal
+        (default is None)
+        The journal of the file, see `db_journal`.
+    Returns
+    -------
+    summary : dict
+        The outcome of every document, see `bulk_execute`. None if the journal says the body is already recorded.
+    Notes
+    -----
+    A body that was sent without an answer is sent again with its conflicts skipped rather than reported, since
+    they are the documents that reached the database before the connection dropped.
+    """
+    policy = conflict_policy
+    if journal is not None:
+        status = journal.status(number, body)
+        if status == journal_methods.DONE:
+            return None
+        if status == journal_methods.SENT and conflict_policy == "report":
+            policy = "skip"
+        journal.mark_sent(number, body, count)
+    with metrics_methods.timed("transport", size=len(body)):
+        summary = bulk_execute(transport, database_name, body, conflict_policy=policy)
+    if journal is not None:
+        journal.mark_done(number, summary["failed_docs"])
+    metrics_methods.count("failed_documents", len(summary["failed_docs"]))
+    return summary
+
+
+def upload_bodies(transport, database_name, bodies, conflict_policy="report", journal=None, uploads=1):
+    """
+    Sends the `_bulk_docs` bodies of one file, skipping the ones its journal says are already recorded.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    bodies : iterable
+        The serialized bodies of the file with the number of documents in each, always in the same order, e.g. from
+        `iter_csv_bodies`.
+    conflict_policy : str
+        (default is "report")
+        What to do with documents already in the database, one of db_methods.CONFLICT_POLICIES.
+    journal : IngestJournal
+        (default is None)
+        The journal of the file, see `db_journal`. Every body is sent when None.
+    uploads : int
+        (default is 1)
+        Number of bodies in flight at the same time. With more than one, the next bodies are read and serialized
+        while the previous ones are being sent, see `db_async.pipeline`. The transport should have as many
+        connections.
+    Returns
+    -------
+    result : int
+        A nonzero value indicates an error code, see `summary_code`.
+    failed_docs : list
+        The documents that couldn't be recorded, in the order of the file, including those of an earlier run found
+        in the journal.
+    """
+    if uploads > 1:
+        summaries = async_methods.run(async_methods.pipeline(
+            enumerate(bodies), lambda item: send_body(transport, database_name, item[0], *item[1], conflict_policy,
+                                                      journal), uploads))
+    else:
+        summaries = (send_body(transport, database_name, number, body, count, conflict_policy, journal)
+                     for number, (body, count) in enumerate(bodies))
+    result = 0
+    failed_docs = []
+    skipped = 0
+    for summary in summaries:
+        if summary is None:
+            skipped += 1
+            continue
+        failed_docs.extend(summary["failed_docs"])
+        result = max(result, summary_code(summary))
+    if journal is not None:
+        if skipped:
+            print("Resumed after", skipped, "batches already recorded")
+            metrics_methods.count("resumed_batches", skipped)
+        failed_docs = journal.failed_docs()
+        if failed_docs:
+            result = max(result, 1)
+    return result, failed_docs
+
+
+def resolve_conflicts(transport, database_name, docs, policy, retries=RETRIES):
+    """
+    Records documents that conflicted with documents already in the database.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    docs : list
+        The documents that conflicted.
+    policy : str
+        "skip" keeps the stored documents and only counts them. "overwrite" and "merge" read the `_rev` of the
+        stored documents and replace them, see `db_methods.resolve_conflict`.
+    retries : int
+        (default is RETRIES)
+        Number of times documents that conflict again, because they changed in the meantime, are resolved again.
+    Returns
+    -------
+    summary : dict
+        The outcome of every document, see `db_response.summarize`.
+    """
+    summary = response_methods.summarize([])
+    if policy == "skip":
+        summary["skipped"] = len(docs)
+        return summary
+    for attempt in range(retries + 1):
+        method, path, body = methods.all_docs_request([doc["_id"] for doc in docs], database_name)
+        with transport.stream(method, path, body) as (status, response):
+            existing = {row["key"]: row.get("doc") for row in response_methods.iter_json_items(response)
+                        if "key" in row}
+        resolved = [methods.resolve_conflict(doc, existing.get(doc["_id"]), policy) for doc in docs]
+        method, path, body = methods.bulk_docs_request(serialize_methods.dumps({"docs": resolved}), database_name)
+        with transport.stream(method, path, body) as (status, response):
+            attempt_summary = response_methods.summarize_stream(response)
+        summary["ok"] += attempt_summary["ok"]
+        summary["error"] += attempt_summary["error"]
+        summary["error_ids"] += attempt_summary["error_ids"]
+        for reason, count in attempt_summary["reasons"].items():
+            if reason != "conflict":
+                summary["reasons"][reason] = summary["reasons"].get(reason, 0) + count
+        conflicting = set(attempt_summary["conflict_ids"])
+        docs = [doc for doc in docs if doc["_id"] in conflicting]
+        if docs == [] or attempt == retries:
+            break
+        metrics_methods.count("retries")
+    summary["conflict"] = len(docs)
+    summary["conflict_ids"] = [doc["_id"] for doc in docs]
+    if docs:
+        summary["reasons"]["conflict"] = len(docs)
+    return summary
+
+
+def _merge_summaries(summary, retry):
+    merged = dict(summary)
+    merged["ok"] = summary["ok"] + retry["ok"]
+    merged["conflict"] = summary["conflict"] + retry["conflict"]
+    merged["conflict_ids"] = summary["conflict_ids"] + retry["conflict_ids"]
+    merged["error"] = retry["error"]
+    merged["error_ids"] = retry["error_ids"]
+    merged["reasons"] = {reason: count for reason, count in summary["reasons"].items() if reason == "conflict"}
+    for reason, count in retry["reasons"].items():
+        merged["reasons"][reason] = merged["reasons"].get(reason, 0) + count
+    return merged
+
+
+def _resolved_summary(summary, resolution):
+    merged = dict(summary)
+    merged["ok"] = summary["ok"] + resolution["ok"]
+    merged["skipped"] = summary["skipped"] + resolution["skipped"]
+    merged["conflict"] = resolution["conflict"]
+    merged["conflict_ids"] = resolution["conflict_ids"]
+    merged["error"] = summary["error"] + resolution["error"]
+    merged["error_ids"] = summary["error_ids"] + resolution["error_ids"]
+    merged["reasons"] = {reason: count for reason, count in summary["reasons"].items() if reason != "conflict"}
+    for reason, count in resolution["reasons"].items():
+        merged["reasons"][reason] = merged["reasons"].get(reason, 0) + count
+    return merged
+
+
 # MAIN FUNCTIONS
 
+def migrate_views(transport, database_name, group_size=methods.GROUP_SIZE):
+    """
+    Moves the views of design documents named after a header into grouped design documents.
+
+    The old design documents are only deleted once every grouped design document has been created, so an
+    interrupted migration can simply be run again.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    group_size : int
+        (default is db_methods.GROUP_SIZE)
+        Largest number of views in one design document.
+    Returns
+    -------
+    :int
+        A nonzero value indicates an error code.
+    """
+    design_documents = methods.return_design_documents(transport, database_name)
+    create_requests, delete_requests = methods.migrate_views_requests(design_documents, database_name, group_size)
+    if delete_requests == []:
+        return 0
+    print("Migrating", len(delete_requests), "views into grouped design documents")
+    if execute_requests(transport, create_requests) != 0:
+        print("View migration unsuccessful, the old design documents are kept")
+        return 1
+    return execute_requests(transport, delete_requests)
+
+
 def create_database(database_name):
     """
     Creates and initializes database with the create_database and create_first view functions.
@@ -128,37 +534,323 @@ def create_database(database_name):
     common initial errors.
     """
     name = database_name.lower()
-    db_command = methods.create_database(name)
-    view_command = methods.create_first_view(name)
+    db_request = methods.create_database_request(name)
+    view_request = methods.create_first_view_request(name)
     try:
         ssh = ssh_connect()
-        if ssh_execute(ssh, db_command) == 0:
-            if ssh_execute(ssh, view_command) == 0:
+        transport = http_connect(ssh)
+        if http_execute(transport, db_request) == 0:
+            if http_execute(transport, view_request) == 0:
                 print("Successful creation and initialization of database")
+        transport.close()
         ssh_disconnect(ssh)
-    except paramiko.ssh_exception.SSHException:
+    except (paramiko.ssh_exception.SSHException, OSError):
         return str(1)
 
 
-def record_data_from_csv(database_name, csv_file):
+def reconcile_views(transport, database_name, headers, grouped_views=True, bucketed=False, stats_views=True,
+                    fingerprint=None):
+    """
+    Makes sure every header has a view, creating the missing ones.
+
+    Headers found in the local view cache cost no request to the database. Otherwise the views of the database are
+    read, design documents named after a header are migrated into groups and the cache is brought up to date. Once
+    the views of a set of headers are made, its fingerprint is cached too, so the next files with the same headers
+    skip the reconciliation altogether.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    headers : list
+        All the headings of the CSV file.
+    grouped_views : bool
+        (default is True)
+        Puts new views in grouped design documents, see `db_methods.create_views_requests`.
+    bucketed : bool
+        (default is False)
+        The data is stored in buckets, which have a single view for all headers, see `db_buckets`.
+    stats_views : bool
+        (default is True)
+        Also makes sure every header has a statistics view, see `reconcile_stats_views`.
+    fingerprint : str
+        (default is None)
+        The fingerprint of the headers, from `db_validate.validate_csv`. Worked out from the headers when None.
+    Returns
+    -------
+    :int
+        A nonzero value indicates that some views couldn't be created.
+    Notes
+    -----
+    The cache of the database is emptied when creating a view fails or conflicts, fingerprints included.
+    """
+    if fingerprint is None:
+        fingerprint = validate_methods.header_fingerprint(headers)
+    # Headers can't hold ":", so the key of a schema is never taken for a header.
+    schema = SCHEMA_PREFIX + fingerprint + (":buckets" if bucketed else "") + (":stats" if stats_views else "")
+    with metrics_methods.timed("views"):
+        if schema in cache_methods.known_views(database_name):
+            return 0
+        if bucketed:
+            result = reconcile_bucket_view(transport, database_name)
+        else:
+            result = reconcile_map_views(transport, database_name, headers, grouped_views)
+        if result == 0 and stats_views:
+            result = reconcile_stats_views(transport, database_name, headers)
+        if result == 0:
+            cache_methods.remember_views(database_name, [schema])
+    return result
+
+
+def reconcile_map_views(transport, database_name, headers, grouped_views=True):
+    """
+    Makes sure every header has a (timestamp, value) view, see `reconcile_views`.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    headers : list
+        All the headings of the CSV file.
+    grouped_views : bool
+        (default is True)
+        Puts new views in grouped design documents.
+    Returns
+    -------
+    :int
+        A nonzero value indicates that some views couldn't be created.
+    """
+    if cache_methods.known_views(database_name).issuperset(headers):
+        return 0
+    if grouped_views:
+        migrate_views(transport, database_name)
+    existing_views = methods.return_existing_views_http(transport, database_name)
+    cache_methods.remember_views(database_name, existing_views)
+    missing_views = methods.compare_views(headers, existing_views)
+    all_view_requests = methods.create_views_requests(missing_views, database_name, grouped_views)
+    if all_view_requests == 0:
+        return 0
+    print("Some views necessary")
+    result = execute_requests(transport, all_view_requests)
+    if result == 0:
+        cache_methods.remember_views(database_name, missing_views)
+    else:
+        cache_methods.forget_views(database_name)
+    return result
+
+
+def reconcile_stats_views(transport, database_name, headers):
+    """
+    Makes sure every header but the timestamp has a statistics view, which reduces its values per minute, hour,
+    day, month or year, see `db_methods.stats_group_document`.
+
+    Statistics views are kept in the view cache as db_methods.STATS_PREFIX + header.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    headers : list
+        All the headings of the CSV file.
+    Returns
+    -------
+    :int
+        A nonzero value indicates that some views couldn't be created.
+    """
+    headers = [header for header in headers if header != "timestamp"]
+    known = cache_methods.known_views(database_name)
+    missing_views = [header for header in headers if methods.STATS_PREFIX + header not in known]
+    if missing_views == []:
+        return 0
+    existing_views = methods.stats_locations(methods.return_design_documents(transport, database_name))
+    cache_methods.remember_views(database_name, [methods.STATS_PREFIX + header for header in existing_views])
+    missing_views = [header for header in missing_views if header not in existing_views]
+    if missing_views == []:
+        return 0
+    print("Some statistics views necessary")
+    result = execute_requests(transport, methods.create_stats_views_requests(missing_views, database_name))
+    if result == 0:
+        cache_methods.remember_views(database_name, [methods.STATS_PREFIX + header for header in missing_views])
+    else:
+        cache_methods.forget_views(database_name)
+    return result
+
+
+def reconcile_bucket_view(transport, database_name):
+    """
+    Makes sure the view listing the buckets of a database exists, see `db_buckets`.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database_name : str
+        Name of the database.
+    Returns
+    -------
+    :int
+        A nonzero value indicates that the view couldn't be created.
+    """
+    design_id = "_design/" + buckets_methods.BUCKET_DESIGN
+    if design_id in cache_methods.known_views(database_name):
+        return 0
+    # A conflict means the design document is already there.
+    if http_execute(transport, buckets_methods.bucket_view_request(database_name)) == 2:
+        return 2
+    cache_methods.remember_views(database_name, [design_id])
+    return 0
+
+
+def iter_csv_bodies(csv_file_path, max_bytes=methods.BATCH_MAX_BYTES, max_docs=methods.BATCH_MAX_DOCS,
+                    infer_types=True, schema=None, id_scheme="timestamp", source=None, bucket_seconds=None,
+                    reader="dict", serializer=None, reuse=False):
+    """
+    Reads a CSV file and serializes its rows into `_bulk_docs` bodies, one body at a time.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the size of each body.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents in each body.
+    infer_types : bool
+        (default is True)
+        Writes typed values, see `db_types`.
+    schema : dict
+        (default is None)
+        Column types that override the inferred ones.
+    id_scheme : str
+        (default is "timestamp")
+        How document ids are made from the timestamp, one of db_ids.ID_SCHEMES.
+    source : str
+        (default is None)
+        Name of the instrument prefixing every id.
+    bucket_seconds : int
+        (default is None)
+        Packs the rows of every window of that many seconds into one document, see `db_buckets`.
+    reader : str
+        (default is "dict")
+        How the CSV is read, one of db_columnar.READERS. Buckets are always made from the rows read one by one.
+    serializer : str
+        (default is None)
+        How documents are turned into JSON, one of db_serialize.SERIALIZERS. orjson when installed if None. The
+        columnar reader writes its own JSON.
+    reuse : bool
+        (default is False)
+        Builds every body in the same buffer, so a body must be sent before the next one is asked for, see
+        `db_methods.iter_json_bodies`.
+    Returns
+    -------
+    bodies : generator
+        The serialized bodies, each with the number of documents in it, see `db_methods.iter_json_bodies`.
+    """
+    column_types = None
+    if infer_types:
+        with metrics_methods.timed("convert", items=0):
+            column_types = types_methods.infer_column_types(methods.iter_csv_file(csv_file_path), schema=schema)
+    if reader == "columnar" and bucket_seconds is None:
+        parts = columnar_methods.iter_json_documents(csv_file_path, column_types, id_scheme, source)
+        bodies = methods.iter_json_bodies(parts, max_bytes, max_docs, reuse, counts=True)
+    else:
+        docs = metrics_methods.iter_timed("read", methods.iter_csv_file(csv_file_path, id_scheme, source))
+        if infer_types:
+            docs = types_methods.iter_typed_documents(docs, column_types)
+        if bucket_seconds is not None:
+            docs = buckets_methods.iter_bucket_documents(docs, bucket_seconds, id_scheme, source)
+        if infer_types or bucket_seconds is not None:
+            docs = metrics_methods.iter_timed("convert", docs)
+        bodies = methods.iter_bulk_bodies(docs, max_bytes, max_docs, serializer, reuse, counts=True)
+    return metrics_methods.iter_timed("serialize", bodies, size=lambda item: len(item[0]))
+
+
+def record_data_from_csv(database_name, csv_file, max_bytes=methods.BATCH_MAX_BYTES,
+                         max_docs=methods.BATCH_MAX_DOCS, infer_types=True, schema=None, grouped_views=True,
+                         conflict_policy="report", id_scheme="timestamp", source=None, bucket_seconds=None,
+                         reader="dict", uploads=UPLOADS, serializer=None, validate=True):
     """
     Records data from csv into the database with an optional conflict directory.
 
+    The rows of the CSV are streamed straight into size-bounded `_bulk_docs` request bodies, so there is no limit
+    on the size of the CSV, memory use doesn't grow with it and no intermediate JSON file is written. All requests
+    go over one pool of keep-alive HTTP connections. The next bodies are read and serialized while the previous
+    ones are being sent, and the missing views are created at the same time, see `db_async`.
+
+    Every batch is recorded in a journal next to the CSV, see `db_journal`. When the connection drops halfway, the
+    journal is kept and running the function again only sends the batches that weren't confirmed.
+
     Parameters
     ----------
     database_name: str
         Desired name of database.
     csv_file :str
         CSV file name.
-    abs_file_path: str
-        Absolute file path to CSV.
-    conflict_dir: str
-        Name of the directory where the CSV will be deposited if any errors occur.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the length of the payload of each batch.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents (rows) in each batch.
+    infer_types : bool
+        (default is True)
+        Writes numbers, booleans and nulls as native JSON values, with column types inferred from the first rows.
+        All values are written as strings when False.
+    schema : dict
+        (default is None)
+        Column types that override the inferred ones, e.g. {"serial_number": "str"}. See `db_types.column_type`.
+    grouped_views : bool
+        (default is True)
+        Creates the views of new headers together in few design documents, so CouchDB indexes them in one pass over
+        the database, and migrates design documents named after a header into groups first. Every header gets a
+        design document of its own when False. See `reconcile_views`.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows whose timestamp is already in the database, one of db_methods.CONFLICT_POLICIES. Rows
+        that still can't be recorded are written to <file>_conflict.csv and the rest of the CSV is deleted.
+    id_scheme : str
+        (default is "timestamp")
+        How document ids are made from the timestamp of each row, one of db_ids.ID_SCHEMES. "compact" ids are
+        shorter and sort in the order of time.
+    source : str
+        (default is None)
+        Name of the instrument prefixing every id, so that instruments logging at the same time don't conflict.
+    bucket_seconds : int
+        (default is None)
+        Packs the rows of every window of that many seconds into one document with an array per column, see
+        `db_buckets`. Every row is a document of its own when None. Read bucketed data with `read_buckets`.
+    reader : str
+        (default is "dict")
+        How the CSV is read, one of db_columnar.READERS. "columnar" reads blocks of rows column-wise and writes the
+        documents straight from the columns, which is several times faster for files with many columns. Ignored
+        with `bucket_seconds`.
+    uploads : int
+        (default is UPLOADS)
+        Number of bodies in flight at the same time. With one, every step runs after the previous one and every
+        body is built in the same buffer.
+    serializer : str
+        (default is None)
+        How documents are turned into JSON, one of db_serialize.SERIALIZERS. orjson when installed if None.
+    validate : bool
+        (default is True)
+        Checks the file before connecting, see `db_validate`. An invalid file is renamed to *_conflict.csv and
+        nothing is sent.
     Returns
     -------
     :int
         A nonzero value indicates an error code with two signifying catastrophic failure and one signifying a failure
-        that may be informational instead of breaking the code.
+        that may be informational instead of breaking the code, see db_ingest.STATUS. Zero when every row was
+        recorded, one when some rows were written to <file>_conflict.csv or the connection failed, two when the file
+        is invalid or nothing could be sent. Views that couldn't be created are printed and logged but don't change
+        it, since the data is recorded.
     Throws
     -----
     SSHException
@@ -168,47 +860,179 @@ def record_data_from_csv(database_name, csv_file):
     The name of database is corrected to be lowercase because that's all that CouchDB allows and it's one of the most
     common initial errors.
     """
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    json_file_path = dir_path + "\\" + os.path.splitext(csv_file)[0] + ".json"
-    json_file = methods.csv_to_json(csv_file, json_file_path)
-    data = methods.format_and_make_string(json_file, json_file_path)
-    data_command = methods.write_to_database(data, database_name)
     headers = methods.find_view_names(csv_file)
-    if data_command == 1 or headers == 1:
+    if headers == 1:
         print("The CSV file can't be found")
-        methods.cleanup_directory(csv_file, json_file_path, 1)
+        methods.cleanup_directory(csv_file, None, 1)
         return 1
+    fingerprint = None
+    if validate:
+        with metrics_methods.timed("read", items=0):
+            try:
+                headers, fingerprint, problems = validate_methods.validate_csv(methods.project_path(csv_file))
+            except csv.Error as error:
+                problems = [str(error)]
+        if problems:
+            print("The CSV file is invalid, nothing was recorded:")
+            for problem in problems:
+                print("   ", problem)
+            methods.cleanup_directory(csv_file, None, 2)
+            return 2
     try:
         ssh = ssh_connect()
+        # One more connection than uploads, for the views created in the meantime.
+        transport = transport_methods.connect(ssh, pool_size=max(transport_methods.POOL_SIZE, uploads + 1))
         name = database_name.lower()
-        existing_views = methods.return_existing_views(ssh, name)
-        missing_views = methods.compare_views(headers, existing_views)
-        if ssh_execute(ssh, data_command) < 2:
-            print("Data successfully recorded")
-            all_view_commands = methods.create_views(missing_views, name)
-            if all_view_commands == 0:
-                print("No new views necessary")
-                print("Data successfully recorded and indexed")
-                methods.cleanup_directory(csv_file, json_file_path, 0)
+        csv_file_path = methods.project_path(csv_file)
+        bodies = iter_csv_bodies(csv_file_path, max_bytes, max_docs, infer_types, schema, id_scheme, source,
+                                 bucket_seconds, reader, serializer, reuse=uploads <= 1)
+        journal = journal_methods.IngestJournal(csv_file_path)
+        upload = functools.partial(upload_bodies, transport, name, bodies, conflict_policy, journal, uploads)
+        views = functools.partial(reconcile_views, transport, name, headers, grouped_views, bucket_seconds is not None,
+                                  fingerprint=fingerprint)
+        try:
+            if uploads > 1:
+                (result, failed_docs), views_result = async_methods.run(async_methods.concurrently(upload, views))
             else:
-                print("Some views necessary")
-                clean_up = True
-                for command in all_view_commands:
-                    if ssh_execute(ssh, command) != 0:
-                        clean_up = False
-                if clean_up:
-                    print("Data successfully recorded and indexed")
-                    methods.cleanup_directory(csv_file, json_file_path, 0)
-                else:
-                    print("View creation unsuccessful, a new conflict document is being created.")
-                    methods.cleanup_directory(csv_file, json_file_path, 1)
+                result, failed_docs = upload()
+                views_result = views()
+        finally:
+            journal.close()
+        print("Data successfully recorded" if failed_docs == [] else "Data recorded except for some rows")
+        # The data is recorded whether or not the views could be made, so the file is cleaned up either way and
+        # isn't sent again. The views are made again with the next file with these headers, see `reconcile_views`.
+        if views_result == 0:
+            print("Data successfully indexed")
         else:
-            print("Data recording unsuccessful, a new conflict document is being created.")
-            methods.cleanup_directory(csv_file, json_file_path, 1)
+            print("View creation unsuccessful, the data can't be read by some views until they are created.")
+        with metrics_methods.timed("cleanup"):
+            methods.cleanup_failed_rows(csv_file_path, headers, failed_docs)
+            journal_methods.remove_journal(csv_file_path)
+        metrics_methods.write_log(file=csv_file_path, result=result, views=views_result)
+        transport.close()
         ssh_disconnect(ssh)
-    except paramiko.ssh_exception.SSHException:
+    except (paramiko.ssh_exception.SSHException, OSError):
         return 1
-    return 'Complete Success'
+    return result
+
+
+def read_data(database_name, columns, start, end, source=None, cache=None):
+    """
+    Reads the values of one or more columns over a range of time.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range, e.g. '2020-08-01 00:00:00'.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    source : str
+        (default is None)
+        Only reads the data of one instrument, see `db_query.query_columns`.
+    cache : ColumnCache
+        (default is None)
+        Reads the columns from this local cache when it has them, without connecting to the database, and adds the
+        others to it, see `db_columns`. Nothing is cached when None.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) NumPy arrays of every column, see `db_query.query_columns`. One is returned if the
+        database couldn't be reached.
+    """
+    name = database_name.lower()
+    if cache is not None and source is None:
+        data = columns_methods.cached_columns(cache, name, columns, start, end)
+        if len(data) == len([columns] if isinstance(columns, str) else columns):
+            return data
+    try:
+        ssh = ssh_connect()
+        transport = http_connect(ssh)
+        if cache is not None and source is None:
+            data = columns_methods.query_columns_cached(transport, name, columns, start, end, cache)
+        else:
+            data = query_methods.query_columns(transport, name, columns, start, end, source=source)
+        transport.close()
+        ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return data
+
+
+def read_buckets(database_name, columns, start, end, bucket_seconds=buckets_methods.BUCKET_SECONDS, source=None):
+    """
+    Reads the values of one or more columns of bucketed data over a range of time.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    bucket_seconds : int
+        (default is db_buckets.BUCKET_SECONDS)
+        Length of the windows the data was recorded with.
+    source : str
+        (default is None)
+        Only reads the data of one instrument.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) NumPy arrays of every column, see `db_query.query_buckets`. One is returned if the
+        database couldn't be reached.
+    """
+    try:
+        ssh = ssh_connect()
+        transport = http_connect(ssh)
+        data = query_methods.query_buckets(transport, database_name.lower(), columns, start, end, bucket_seconds,
+                                           source=source)
+        transport.close()
+        ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return data
+
+
+def read_stats(database_name, columns, start, end, points=query_methods.PLOT_POINTS):
+    """
+    Reads statistics of one or more columns over a range of time, at a resolution fit for plotting.
+
+    Parameters
+    ----------
+    database_name: str
+        Name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    points : int
+        (default is db_query.PLOT_POINTS)
+        Largest number of points wanted per column.
+    Returns
+    -------
+    data : dict
+        The statistics of every column, see `db_query.query_stats`. One is returned if the database couldn't be
+        reached.
+    """
+    try:
+        ssh = ssh_connect()
+        transport = http_connect(ssh)
+        data = query_methods.query_stats(transport, database_name.lower(), columns, start, end, points)
+        transport.close()
+        ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return data
+
 
 if __name__ == '__main__':
     create_database("Hello_World")
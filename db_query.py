@@ -0,0 +1,432 @@
+"""
+Reading data back out of the database over a range of time.
+
+The per-column views are read page by page with startkey/endkey and turned into NumPy arrays, so months of data
+never sit in memory as Python lists of dictionaries.
+"""
+
+import datetime
+import json
+import urllib.parse
+
+import numpy as np
+
+import db_buckets as buckets_methods
+import db_ids as ids_methods
+import db_methods as methods
+
+PAGE_SIZE = 10000
+# Buckets hold hundreds of rows each, so far fewer of them are read per request.
+BUCKET_PAGE_SIZE = 100
+PLOT_POINTS = 1000
+# Approximate length in seconds of the groups of every group_level of the statistics views, whose keys are
+# [year, month, day, hour, minute].
+GROUP_SECONDS = {1: 31556952, 2: 2629746, 3: 86400, 4: 3600, 5: 60}
+
+
+def format_timestamp(value):
+    """
+    Formats a timestamp the way it's stored in the database, yyyy-mm-dd hh:mm:ss.
+
+    Parameters
+    ----------
+    value : str, datetime or numpy.datetime64
+        The timestamp.
+    Returns
+    -------
+    str
+        The formatted timestamp. Strings are returned as they are.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(np.datetime64(value, "s")).replace("T", " ")
+
+
+def view_path(database, location):
+    """
+    Returns the path of a view.
+
+    Parameters
+    ----------
+    database : str
+        The name of the database.
+    location : tuple
+        The (design document name, view name) of the view, from `db_methods.view_locations`.
+    Returns
+    -------
+    str
+        The path of the view, e.g. /database/_design/temperature/_view/show_specs.
+    """
+    design_name, view_name = location
+    return "/" + database + "/_design/" + urllib.parse.quote(design_name) + "/_view/" + urllib.parse.quote(view_name)
+
+
+def iter_view_pages(transport, path, start, end, page_size=PAGE_SIZE, include_docs=False):
+    """
+    Reads the rows of a view between two keys, one page at a time.
+
+    Pages follow each other by key, with one extra row asking where the next page starts, instead of with skip,
+    which CouchDB would have to walk through on every page.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    path : str
+        The path of the view, from `view_path`.
+    start : str
+        First key of the range.
+    end : str
+        Last key of the range, included.
+    page_size : int
+        (default is PAGE_SIZE)
+        Number of rows per request.
+    include_docs : bool
+        (default is False)
+        Adds the document of every row as its "doc".
+    Yields
+    ------
+    rows : list
+        The rows of one page, each with an "id", a "key" and a "value".
+    Throws
+    -----
+    ValueError
+        CouchDB answered with an error.
+    """
+    params = {"startkey": json.dumps(start), "endkey": json.dumps(end), "limit": str(page_size + 1)}
+    if include_docs:
+        params["include_docs"] = "true"
+    while True:
+        status, data = transport.request("GET", path + "?" + urllib.parse.urlencode(params))
+        result = json.loads(data)
+        if status != 200:
+            raise ValueError("Error reading " + path + ": " + str(result.get("error")) + " " +
+                             str(result.get("reason")))
+        rows = result["rows"]
+        if len(rows) <= page_size:
+            yield rows
+            return
+        yield rows[:page_size]
+        params["startkey"] = json.dumps(rows[page_size]["key"])
+        params["startkey_docid"] = rows[page_size]["id"]
+
+
+def rows_to_arrays(rows):
+    """
+    Turns the rows of a view into arrays of timestamps and values.
+
+    Parameters
+    ----------
+    rows : list
+        The rows, each with a timestamp "key" and a "value".
+    Returns
+    -------
+    timestamps : numpy.ndarray
+        The keys as datetime64[us], which keeps the fractions of a second timestamps may have, see `db_validate`.
+    values : numpy.ndarray
+        The values as float64. Values that aren't numbers become NaN.
+    Examples
+    --------
+    >>> timestamps, values = rows_to_arrays([{"key": "2020-01-01 00:00:00.25", "value": 1},
+    ...                                      {"key": "2020-01-01 00:00:00.75", "value": "x"}])
+    >>> timestamps
+    array(['2020-01-01T00:00:00.250000', '2020-01-01T00:00:00.750000'],
+          dtype='datetime64[us]')
+    >>> values
+    array([ 1., nan])
+    """
+    timestamps = np.array([row["key"] for row in rows], dtype="datetime64[us]")
+    values = [row["value"] for row in rows]
+    try:
+        values = np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.array([_to_float(value) for value in values], dtype=np.float64)
+    return timestamps, values
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def query_columns(transport, database, columns, start, end, page_size=PAGE_SIZE, source=None):
+    """
+    Returns the values of one or more columns over a range of time.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    page_size : int
+        (default is PAGE_SIZE)
+        Number of rows per request.
+    source : str
+        (default is None)
+        Only reads the documents of one instrument, told apart by the prefix of their id, see `db_ids`. The
+        documents of every instrument are read when None.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) arrays of every column, see `rows_to_arrays`.
+    Notes
+    -----
+    Columns are found in grouped design documents as well as in design documents named after the header. A column
+    without a view is looked for at _design/<header>/_view/show_specs. Views are keyed by the timestamp field of the
+    documents rather than by their id, so they work the same with every id scheme.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    start = format_timestamp(start)
+    end = format_timestamp(end)
+    locations = methods.view_locations(methods.return_design_documents(transport, database))
+
+    data = {}
+    for column in columns:
+        path = view_path(database, locations.get(column, (column, "show_specs")))
+        timestamps = []
+        values = []
+        for rows in iter_view_pages(transport, path, start, end, page_size):
+            if source is not None:
+                rows = [row for row in rows if ids_methods.split_id(row["id"])[0] == source]
+            page_timestamps, page_values = rows_to_arrays(rows)
+            timestamps.append(page_timestamps)
+            values.append(page_values)
+        data[column] = (np.concatenate(timestamps), np.concatenate(values))
+    return data
+
+
+def bucket_to_arrays(bucket, columns):
+    """
+    Unpacks the arrays of a bucket, see `db_buckets`.
+
+    Parameters
+    ----------
+    bucket : dict
+        The bucket.
+    columns : list
+        The headers to unpack.
+    Returns
+    -------
+    timestamps : numpy.ndarray
+        The timestamps of the rows as datetime64[ms].
+    values : dict
+        The values of every column as float64, NaN where a row has no value.
+    """
+    offsets = np.array(bucket["offsets"], dtype=np.float64)
+    timestamps = np.datetime64(bucket["timestamp"].replace(" ", "T"), "ms") + \
+        np.round(offsets * 1000).astype("timedelta64[ms]")
+    values = {}
+    for column in columns:
+        column_values = bucket.get(column)
+        if column_values is None:
+            values[column] = np.full(len(offsets), np.nan)
+            continue
+        try:
+            values[column] = np.array(column_values, dtype=np.float64)
+        except (TypeError, ValueError):
+            values[column] = np.array([_to_float(value) for value in column_values], dtype=np.float64)
+    return timestamps, values
+
+
+def query_buckets(transport, database, columns, start, end, bucket_seconds=buckets_methods.BUCKET_SECONDS,
+                  page_size=BUCKET_PAGE_SIZE, source=None):
+    """
+    Returns the values of one or more columns of bucketed data over a range of time.
+
+    All columns are read from the same buckets, with one request per page of buckets no matter how many columns
+    are asked for.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included.
+    bucket_seconds : int
+        (default is db_buckets.BUCKET_SECONDS)
+        Length of the windows the data was recorded with, so the bucket holding `start` is read as well.
+    page_size : int
+        (default is BUCKET_PAGE_SIZE)
+        Number of buckets per request.
+    source : str
+        (default is None)
+        Only reads the buckets of one instrument, see `query_columns`.
+    Returns
+    -------
+    data : dict
+        The (timestamps, values) arrays of every column. Timestamps are datetime64[ms], since rows can be less than
+        a second apart.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    start = format_timestamp(start)
+    end = format_timestamp(end)
+    first_window = buckets_methods.window_start(ids_methods.parse_timestamp(start), bucket_seconds)
+    path = view_path(database, (buckets_methods.BUCKET_DESIGN, buckets_methods.BUCKET_VIEW))
+    lower = np.datetime64(start.replace(" ", "T"), "ms")
+    upper = np.datetime64(end.replace(" ", "T"), "ms")
+
+    timestamps = []
+    values = {column: [] for column in columns}
+    for rows in iter_view_pages(transport, path, first_window.strftime(buckets_methods.TIMESTAMP_FORMAT), end,
+                                page_size, include_docs=True):
+        for row in rows:
+            if row.get("doc") is None:
+                continue
+            if source is not None and ids_methods.split_id(row["id"])[0] != source:
+                continue
+            bucket_timestamps, bucket_values = bucket_to_arrays(row["doc"], columns)
+            inside = (bucket_timestamps >= lower) & (bucket_timestamps <= upper)
+            timestamps.append(bucket_timestamps[inside])
+            for column in columns:
+                values[column].append(bucket_values[column][inside])
+    if timestamps == []:
+        empty = np.array([], dtype="datetime64[ms]")
+        return {column: (empty, np.array([], dtype=np.float64)) for column in columns}
+    timestamps = np.concatenate(timestamps)
+    return {column: (timestamps, np.concatenate(values[column])) for column in columns}
+
+
+def stats_key(timestamp):
+    """
+    Returns the [year, month, day, hour, minute] key of a timestamp in the statistics views.
+
+    Parameters
+    ----------
+    timestamp : str, datetime or numpy.datetime64
+        The timestamp.
+    Returns
+    -------
+    list
+        The key.
+    """
+    value = ids_methods.parse_timestamp(format_timestamp(timestamp))
+    return [value.year, value.month, value.day, value.hour, value.minute]
+
+
+def choose_group_level(start, end, points=PLOT_POINTS):
+    """
+    Returns the finest group_level of the statistics views giving at most `points` groups over a range of time.
+
+    Parameters
+    ----------
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range.
+    points : int
+        (default is PLOT_POINTS)
+        Largest number of groups wanted.
+    Returns
+    -------
+    group_level : int
+        From 5 (per minute) down to 1 (per year).
+    """
+    span = (ids_methods.parse_timestamp(format_timestamp(end)) -
+            ids_methods.parse_timestamp(format_timestamp(start))).total_seconds()
+    for group_level in (5, 4, 3, 2):
+        if span / GROUP_SECONDS[group_level] <= points:
+            return group_level
+    return 1
+
+
+def stats_to_arrays(rows):
+    """
+    Turns the rows of a grouped statistics view into arrays.
+
+    Parameters
+    ----------
+    rows : list
+        The rows, each with a key of one to five elements and a _stats value.
+    Returns
+    -------
+    stats : dict
+        "timestamps" (datetime64[m], the start of every group) and "count", "sum", "min", "max", "mean" and "std"
+        (float64) arrays.
+    """
+    defaults = [1970, 1, 1, 0, 0]
+    starts = []
+    for row in rows:
+        key = list(row["key"]) + defaults[len(row["key"]):]
+        starts.append("%04d-%02d-%02dT%02d:%02d" % tuple(key))
+    stats = {"timestamps": np.array(starts, dtype="datetime64[m]")}
+    for field in ("count", "sum", "min", "max", "sumsqr"):
+        stats[field] = np.array([row["value"][field] for row in rows], dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["mean"] = stats["sum"] / stats["count"]
+        stats["std"] = np.sqrt(np.maximum(stats.pop("sumsqr") / stats["count"] - stats["mean"] ** 2, 0))
+    return stats
+
+
+def query_stats(transport, database, columns, start, end, points=PLOT_POINTS, group_level=None):
+    """
+    Returns statistics of one or more columns over a range of time, aggregated by the database.
+
+    The statistics views reduce the values of every minute, hour, day, month or year, so plotting a month of data
+    only reads a few hundred groups instead of every point.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    database : str
+        The name of the database.
+    columns : str or list
+        The header, or headers, to read.
+    start : str, datetime or numpy.datetime64
+        Beginning of the range.
+    end : str, datetime or numpy.datetime64
+        End of the range, included to the minute.
+    points : int
+        (default is PLOT_POINTS)
+        Largest number of groups wanted per column, see `choose_group_level`.
+    group_level : int
+        (default is None)
+        Forces the size of the groups, from 1 (per year) to 5 (per minute), instead of choosing it from `points`.
+    Returns
+    -------
+    data : dict
+        The statistics of every column, see `stats_to_arrays`.
+    Throws
+    -----
+    ValueError
+        A column has no statistics view, or CouchDB answered with an error.
+    """
+    if isinstance(columns, str):
+        columns = [columns]
+    if group_level is None:
+        group_level = choose_group_level(start, end, points)
+    locations = methods.stats_locations(methods.return_design_documents(transport, database))
+    params = {"startkey": json.dumps(stats_key(start)), "endkey": json.dumps(stats_key(end)),
+              "group_level": str(group_level)}
+
+    data = {}
+    for column in columns:
+        if column not in locations:
+            raise ValueError(column + " has no statistics view")
+        path = view_path(database, locations[column]) + "?" + urllib.parse.urlencode(params)
+        status, body = transport.request("GET", path)
+        result = json.loads(body)
+        if status != 200:
+            raise ValueError("Error reading " + path + ": " + str(result.get("error")) + " " +
+                             str(result.get("reason")))
+        data[column] = stats_to_arrays(result["rows"])
+    return data
@@ -0,0 +1,148 @@
+"""
+Incremental parsing of CouchDB responses.
+
+Responses are read a chunk at a time and their results handed out one by one, so a `_bulk_docs` response with
+thousands of entries is never held in memory as a whole, and every entry is looked at rather than only the first.
+"""
+
+import codecs
+import json
+
+CHUNK_SIZE = 65536
+# Errors that mean something is already there or has to be fixed by hand, rather than that the request failed.
+INFORMATIONAL_ERRORS = ("conflict", "file_exists", "not_found", "compilation_error")
+
+
+def iter_json_items(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yields the results of a CouchDB response as they are read.
+
+    A response that is a JSON array, like the one of `_bulk_docs`, yields its elements. A response that is an
+    object with "rows", like the one of `_design_docs` or of a view, yields its rows. Any other object is yielded
+    as it is.
+
+    Parameters
+    ----------
+    stream : file-like
+        The body of the response, read with `read(size)`. It may return bytes or str.
+    chunk_size : int
+        (default is CHUNK_SIZE)
+        Number of bytes read at a time.
+    Yields
+    ------
+    item : dict
+        One result.
+    Throws
+    -----
+    ValueError
+        The response isn't valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    position = 0
+    finished = False
+
+    def fill():
+        nonlocal buffer, position, finished
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            finished = True
+            buffer = buffer[position:] + text_decoder.decode(b"", final=True)
+        else:
+            if isinstance(chunk, bytes):
+                chunk = text_decoder.decode(chunk)
+            buffer = buffer[position:] + chunk
+        position = 0
+
+    # Find the array to read from, either the whole response or its rows.
+    while True:
+        stripped = buffer.lstrip()
+        if stripped.startswith("["):
+            position = len(buffer) - len(stripped) + 1
+            break
+        if stripped.startswith("{"):
+            rows = buffer.find('"rows":')
+            start = buffer.find("[", rows) if rows >= 0 else -1
+            if start >= 0:
+                position = start + 1
+                break
+            if finished:
+                yield json.loads(buffer)
+                return
+        elif stripped != "" or finished:
+            if finished and stripped == "":
+                return
+            raise ValueError("Unexpected response: " + stripped[:200])
+        fill()
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position < len(buffer) and buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if finished:
+                raise
+            fill()
+            continue
+        # raw_decode stops at the end of the buffer for numbers, so an item only counts when more text follows it.
+        if end == len(buffer) and not finished:
+            fill()
+            continue
+        position = end
+        yield item
+
+
+def summarize(items):
+    """
+    Counts the results of a response by outcome.
+
+    Parameters
+    ----------
+    items : iterable
+        The results, e.g. from `iter_json_items`.
+    Returns
+    -------
+    summary : dict
+        The number of "ok", "conflict" and "error" results, the ids of the documents that conflicted
+        ("conflict_ids") or failed otherwise ("error_ids") and the number of results of every kind of error
+        ("reasons"). "skipped" counts conflicts that were left alone on purpose and is filled in by the caller.
+    """
+    summary = {"ok": 0, "conflict": 0, "error": 0, "skipped": 0, "conflict_ids": [], "error_ids": [], "reasons": {}}
+    for item in items:
+        if not isinstance(item, dict) or "error" not in item:
+            summary["ok"] += 1
+            continue
+        reason = item["error"]
+        summary["reasons"][reason] = summary["reasons"].get(reason, 0) + 1
+        if reason == "conflict":
+            summary["conflict"] += 1
+            if "id" in item:
+                summary["conflict_ids"].append(item["id"])
+        else:
+            summary["error"] += 1
+            if "id" in item:
+                summary["error_ids"].append(item["id"])
+    return summary
+
+
+def summarize_stream(stream, chunk_size=CHUNK_SIZE):
+    """
+    Reads a response and counts its results by outcome, see `summarize`.
+
+    Parameters
+    ----------
+    stream : file-like
+        The body of the response.
+    chunk_size : int
+        (default is CHUNK_SIZE)
+        Number of bytes read at a time.
+    Returns
+    -------
+    summary : dict
+        See `summarize`.
+    """
+    return summarize(iter_json_items(stream, chunk_size))
@@ -0,0 +1,70 @@
+"""
+Serialization of documents to JSON.
+
+Every document sent to CouchDB is turned into JSON text by one of SERIALIZERS: orjson, a compiled library that
+writes UTF-8 bytes directly and is several times faster, when it's installed, the json module otherwise. Both give
+valid, properly escaped JSON for the values of a CSV; the text differs only in spacing and in how characters outside
+ASCII are written.
+
+The bodies of `_bulk_docs` requests are put together in a bytearray, see `db_methods.iter_json_bodies`, which is
+handed to the transport as it is.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SERIALIZERS = ("orjson", "json")
+SERIALIZER = "orjson" if orjson is not None else "json"
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode()
+
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # orjson refuses what the json module takes, e.g. integers of more than 64 bits.
+        return _json_dumps(obj)
+
+
+def serializer(name=None):
+    """
+    Returns the function turning a document into JSON with one of SERIALIZERS.
+
+    Parameters
+    ----------
+    name : str
+        (default is None)
+        One of SERIALIZERS, SERIALIZER when None.
+    Returns
+    -------
+    dumps : function
+        Takes a document (dictionary) and returns its JSON text as bytes.
+    Throws
+    -----
+    ImportError
+        orjson is asked for but isn't installed.
+    ValueError
+        The serializer isn't known.
+    """
+    name = SERIALIZER if name is None else name
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("The orjson serializer needs orjson, install it with: pip install orjson")
+        return _orjson_dumps
+    if name == "json":
+        return _json_dumps
+    raise ValueError("Unknown serializer: " + str(name))
+
+
+def dumps(obj):
+    """
+    Returns the JSON text of a document as bytes, written by SERIALIZER.
+    """
+    return serializer()(obj)
@@ -0,0 +1,218 @@
+"""
+Shared SSH connections to the host of the database.
+
+Every entry point used to make its own SSH connection, paying a key exchange and a password authentication for
+every upload. Here one pool of connections per host is kept for the whole process: `shared_pool` hands out the same
+pool to every caller, its connections are kept alive with keep-alive packets and are made again when they drop.
+HTTP connections to CouchDB are direct-tcpip channels multiplexed over these connections, see `db_transport`, so
+many requests run at the same time over a single SSH connection. Connections are only made when a channel or a
+command needs one, so nothing is made when CouchDB is configured to be reached directly, see
+`db_transport.direct_address`.
+
+The host and the credentials come from, in order of precedence:
+
+    the environment   SLOWPY_SSH_HOST, SLOWPY_SSH_PORT, SLOWPY_SSH_USER, SLOWPY_SSH_PASSWORD, SLOWPY_SSH_KEY_FILE,
+                      SLOWPY_SSH_POOL_SIZE and SLOWPY_SSH_KEEPALIVE
+    a config file     the [ssh] section of slowpy.ini in the project folder, or of the file named by SLOWPY_CONFIG,
+                      with the keys host, port, user, password, key_file, pool_size and keepalive
+    SETTINGS          the defaults of the lab computer
+"""
+
+import atexit
+import configparser
+import os
+import threading
+
+import paramiko
+
+SETTINGS = {"host": "132.206.126.208", "port": "2020", "user": "lolx", "password": "x3n0ntpc", "key_file": "",
+            "pool_size": "1", "keepalive": "30"}
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "slowpy.ini")
+ENVIRONMENT_PREFIX = "SLOWPY_SSH_"
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def settings(config_file=None):
+    """
+    Returns the SSH settings, see the order of precedence of this module.
+
+    Parameters
+    ----------
+    config_file : str
+        (default is None)
+        Path of the config file, that of SLOWPY_CONFIG or CONFIG_FILE when None. A missing file is skipped.
+    Returns
+    -------
+    settings : dict
+        "host", "user", "password" and "key_file" as str, None when empty, "port", "pool_size" and "keepalive" as
+        int.
+    Throws
+    -----
+    ValueError
+        A number isn't an integer.
+    """
+    values = dict(SETTINGS)
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(config_file or os.environ.get("SLOWPY_CONFIG", CONFIG_FILE))
+    if parser.has_section("ssh"):
+        values.update((key, value) for key, value in parser.items("ssh") if key in SETTINGS)
+    for key in SETTINGS:
+        value = os.environ.get(ENVIRONMENT_PREFIX + key.upper())
+        if value is not None:
+            values[key] = value
+    for key in ("port", "pool_size", "keepalive"):
+        values[key] = int(values[key])
+    for key in ("host", "user", "password", "key_file"):
+        values[key] = values[key] or None
+    return values
+
+
+def _is_active(client):
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class SSHPool:
+    """
+    SSH connections to one host, shared by every thread and made again when they drop.
+
+    It stands in for a paramiko SSHClient wherever the package takes one: `get_transport` gives the transport to
+    open channels on and `exec_command` runs a command, each on the next connection of the pool.
+
+    Parameters
+    ----------
+    hostname : str
+        Address of the host.
+    port : int
+        Port of the host.
+    username : str
+        Username to make the connections.
+    password : str
+        (default is None)
+        Password to make the connections. The key file, the SSH agent or the default keys are used when None.
+    key_filename : str
+        (default is None)
+        Private key to make the connections.
+    size : int
+        (default is 1)
+        Number of connections. Requests are spread over them, every connection carrying many channels.
+    keepalive : int
+        (default is 30)
+        Seconds between keep-alive packets, so that idle connections aren't dropped by firewalls. Zero sends none.
+    """
+
+    def __init__(self, hostname, port, username, password=None, key_filename=None, size=1, keepalive=30):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.keepalive = keepalive
+        self.clients = [None] * max(size, 1)
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(self.hostname, self.port, self.username, self.password, key_filename=self.key_filename)
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def client(self):
+        """
+        Returns the next connection of the pool, made again if it dropped.
+
+        Returns
+        -------
+        client : SSHClient
+            The connection.
+        Throws
+        -----
+        SSHException
+            The connection couldn't be made.
+        OSError
+            The host couldn't be reached.
+        """
+        with self.lock:
+            position = self.next
+            self.next = (position + 1) % len(self.clients)
+            client = self.clients[position]
+            if client is None or not _is_active(client):
+                if client is not None:
+                    client.close()
+                    print("SSH connection lost, reconnecting")
+                # Made while holding the lock, so threads finding the connection down don't all reconnect.
+                client = self.clients[position] = self._connect()
+            return client
+
+    def get_transport(self):
+        """
+        Returns the paramiko transport of the next connection, to open channels on, see `client`.
+        """
+        return self.client().get_transport()
+
+    def exec_command(self, command, **options):
+        """
+        Runs a command on the host over the next connection, see `SSHClient.exec_command`.
+        """
+        return self.client().exec_command(command, **options)
+
+    def close(self):
+        """
+        Closes every connection of the pool. They are made again when needed.
+        """
+        with self.lock:
+            for client in self.clients:
+                if client is not None:
+                    client.close()
+            self.clients = [None] * len(self.clients)
+
+
+def shared_pool(hostname=None, port=None, username=None, password=None):
+    """
+    Returns the pool of this process for a host, made the first time it's asked for.
+
+    Parameters
+    ----------
+    hostname : str
+        (default is None)
+        Address of the host. Every argument left as None is taken from `settings`.
+    port : int
+        (default is None)
+        Port of the host.
+    username : str
+        (default is None)
+        Username to make the connections.
+    password : str
+        (default is None)
+        Password to make the connections.
+    Returns
+    -------
+    pool : SSHPool
+        The pool, shared by every caller asking for the same host and user.
+    """
+    config = settings()
+    hostname = hostname or config["host"]
+    port = port or config["port"]
+    username = username or config["user"]
+    password = password or config["password"]
+    key = (hostname, port, username, password)
+    with _lock:
+        if key not in _pools:
+            _pools[key] = SSHPool(hostname, port, username, password, config["key_file"], config["pool_size"],
+                                  config["keepalive"])
+        return _pools[key]
+
+
+@atexit.register
+def close_pools():
+    """
+    Closes the connections of every pool, which is done by itself when the process ends.
+    """
+    with _lock:
+        for pool in _pools.values():
+            pool.close()
@@ -0,0 +1,357 @@
+"""
+Incremental recording of CSV files that keep growing.
+
+The byte offset up to which a file has been recorded is kept in a checkpoint next to it, so every run only reads
+and uploads the rows appended since the last one. The batches of the chunk being uploaded are kept in the journal of
+the file, so a chunk whose upload was interrupted is resumed without its rows that already landed being taken for
+conflicts, see `db_journal`.
+"""
+
+import argparse
+import csv
+import json
+import os
+
+import paramiko
+
+import db_ids as ids_methods
+import db_ingest as ingest_methods
+import db_journal as journal_methods
+import db_methods as methods
+import db_metrics as metrics_methods
+import db_module
+import db_serialize as serialize_methods
+import db_transport as transport_methods
+import db_types as types_methods
+import db_validate as validate_methods
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def checkpoint_path(csv_file_path):
+    """
+    Returns the path of the checkpoint of a CSV file, <file>.csv.checkpoint.
+    """
+    return csv_file_path + CHECKPOINT_SUFFIX
+
+
+def load_checkpoint(csv_file_path):
+    """
+    Reads the checkpoint of a CSV file.
+
+    The checkpoint is reset when the file was replaced or truncated since it was written.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    Returns
+    -------
+    checkpoint : dict
+        The "offset" of the first byte not recorded yet, the "headers" and column "types" of the file and the
+        "inode" of the file. "sending" is the end of the chunk being uploaded, if any.
+    """
+    stat = os.stat(csv_file_path)
+    fresh = {"offset": 0, "headers": None, "types": None, "inode": stat.st_ino}
+    try:
+        with open(checkpoint_path(csv_file_path)) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return fresh
+    if checkpoint.get("inode") != stat.st_ino or checkpoint.get("offset", 0) > stat.st_size:
+        print(csv_file_path, "was replaced or truncated, recording it from the start")
+        return fresh
+    return checkpoint
+
+
+def save_checkpoint(csv_file_path, checkpoint):
+    """
+    Writes the checkpoint of a CSV file, replacing the old one in a single step.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    checkpoint : dict
+        The checkpoint, see `load_checkpoint`.
+    """
+    temporary_path = checkpoint_path(csv_file_path) + ".tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temporary_path, checkpoint_path(csv_file_path))
+
+
+def iter_new_lines(csv_file_path, offset):
+    """
+    Reads the complete lines of a file from a byte offset.
+
+    A last line without its line break is still being written, so it's left for the next run.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the file.
+    offset : int
+        Byte offset to start from.
+    Yields
+    ------
+    line : bytes
+        One complete line, with its line break.
+    end : int
+        Byte offset just after the line.
+    """
+    with open(csv_file_path, "rb") as data_file:
+        data_file.seek(offset)
+        for line in data_file:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            yield line, offset
+
+
+def iter_new_chunks(csv_file_path, checkpoint, chunk_rows=methods.BATCH_MAX_DOCS, make_id=None):
+    """
+    Reads the rows appended to a CSV file since the checkpoint, a chunk at a time.
+
+    The header line is read on the first run and kept in the checkpoint.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    checkpoint : dict
+        The checkpoint, see `load_checkpoint`. Its headers are filled in on the first run.
+    chunk_rows : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Number of rows per chunk.
+    make_id : function
+        (default is None)
+        Makes the id of a document from its timestamp, see `db_ids.id_maker`. The timestamp itself is the id when
+        None.
+    Yields
+    ------
+    docs : list
+        The documents of the rows of one chunk.
+    bad_lines : list
+        The lines of the chunk that can't be recorded, see `rows_to_docs`.
+    end : int
+        Byte offset just after the last row of the chunk.
+    Notes
+    -----
+    Fields with line breaks inside quotes aren't supported, since every line is treated as one row. A chunk also
+    ends at the "sending" offset of the checkpoint, so a chunk whose upload was interrupted is read again exactly
+    as it was sent.
+    """
+    lines = []
+    end = checkpoint["offset"]
+    for line, end in iter_new_lines(csv_file_path, checkpoint["offset"]):
+        if checkpoint["headers"] is None:
+            checkpoint["headers"] = next(csv.reader([line.decode("utf-8-sig")]))
+            checkpoint["offset"] = end
+            continue
+        if line.strip() == b"":
+            continue
+        lines.append(line)
+        if len(lines) >= chunk_rows or end == checkpoint.get("sending"):
+            yield rows_to_docs(lines, checkpoint["headers"], make_id) + (end,)
+            lines = []
+    if lines:
+        yield rows_to_docs(lines, checkpoint["headers"], make_id) + (end,)
+
+
+def rows_to_docs(lines, headers, make_id=None):
+    """
+    Turns appended lines of a CSV into documents, setting aside the lines that can't be recorded.
+
+    Appended rows aren't checked with the rest of the file, see `db_validate`, so every line is checked on its own:
+    a line that isn't UTF-8 or CSV, has the wrong number of fields, or has a timestamp that isn't yyyy-mm-dd
+    hh:mm:ss or can't be made into an id is set aside instead of stopping the whole chunk.
+
+    Parameters
+    ----------
+    lines : list
+        The lines, as bytes with their line breaks.
+    headers : list
+        The headings of the CSV file.
+    make_id : function
+        (default is None)
+        Makes the id of a document from its timestamp, see `db_ids.id_maker`. The timestamp itself is the id when
+        None.
+    Returns
+    -------
+    docs : list
+        The documents of the lines that can be recorded.
+    bad_lines : list
+        The other lines, as text, e.g. for `db_methods.write_conflict_lines`.
+    """
+    docs = []
+    bad_lines = []
+    for line in lines:
+        text = line.decode("utf-8", "replace")
+        try:
+            line.decode("utf-8")
+            row = next(csv.reader([text]))
+            if len(row) != len(headers):
+                raise ValueError("wrong number of fields")
+            doc = dict(zip(headers, row))
+            timestamp = doc.get('timestamp')
+            if timestamp is not None and not validate_methods.TIMESTAMP.fullmatch(timestamp):
+                raise ValueError("invalid timestamp")
+            doc['_id'] = make_id(timestamp) if make_id is not None and timestamp is not None else timestamp
+        except (ValueError, csv.Error):
+            bad_lines.append(text)
+            continue
+        docs.append(doc)
+    return docs, bad_lines
+
+
+def record_new_rows(transport, reconciler, database, csv_file_path, max_bytes=methods.BATCH_MAX_BYTES,
+                    max_docs=methods.BATCH_MAX_DOCS, infer_types=True, schema=None, conflict_policy="report",
+                    id_scheme="timestamp", source=None, serializer=None):
+    """
+    Records the rows appended to a CSV file since the last run, and moves its checkpoint forward.
+
+    The checkpoint is saved after every chunk that was recorded, so a run that stops halfway resumes after the last
+    recorded chunk. The chunk it stopped in is resumed from its journal, skipping its batches already recorded and
+    the conflicts of the batch that was sent without an answer. Rows that can't be read or recorded are added to
+    <file>_conflict.csv and the checkpoint still moves past them, so they aren't sent again on every run.
+
+    Parameters
+    ----------
+    transport : CouchTransport
+        The connection pool to CouchDB.
+    reconciler : ViewReconciler
+        Keeps track of the views of the database, see `db_ingest.ViewReconciler`.
+    database : str
+        The name of the database.
+    csv_file_path : str
+        Path of the CSV file.
+    max_bytes : int
+        (default is db_methods.BATCH_MAX_BYTES)
+        Upper limit on the size of each request body.
+    max_docs : int
+        (default is db_methods.BATCH_MAX_DOCS)
+        Upper limit on the number of documents in each request body.
+    infer_types : bool
+        (default is True)
+        Writes typed values, with the types inferred from the first chunk and kept in the checkpoint.
+    schema : dict
+        (default is None)
+        Column types that override the inferred ones.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows already in the database, one of db_methods.CONFLICT_POLICIES.
+    id_scheme : str
+        (default is "timestamp")
+        How document ids are made from the timestamp, one of db_ids.ID_SCHEMES.
+    source : str
+        (default is None)
+        Name of the instrument prefixing every id.
+    serializer : str
+        (default is None)
+        How documents are turned into JSON, one of db_serialize.SERIALIZERS. orjson when installed if None.
+    Returns
+    -------
+    result : int
+        A nonzero value indicates an error code, see `db_ingest.upload_file`. One if some rows couldn't be read,
+        see `rows_to_docs`.
+    rows : int
+        Number of rows recorded in this run.
+    Throws
+    -----
+    ValueError
+        The id scheme or source isn't valid, see `db_ids.id_maker`.
+    """
+    make_id = ids_methods.id_maker(id_scheme, source)
+    checkpoint = load_checkpoint(csv_file_path)
+    result = 0
+    rows = 0
+    chunks = metrics_methods.iter_timed("read", iter_new_chunks(csv_file_path, checkpoint, max_docs, make_id),
+                                        items=lambda chunk: len(chunk[0]) + len(chunk[1]))
+    for docs, bad_lines, end in chunks:
+        failed_docs = []
+        if docs:
+            if infer_types:
+                with metrics_methods.timed("convert", items=len(docs)):
+                    if checkpoint["types"] is None:
+                        checkpoint["types"] = types_methods.infer_column_types(docs, schema=schema)
+                    docs = [types_methods.convert_document(doc, checkpoint["types"]) for doc in docs]
+            checkpoint["sending"] = end
+            save_checkpoint(csv_file_path, checkpoint)
+            bodies = methods.iter_bulk_bodies(docs, max_bytes, max_docs, serializer, counts=True)
+            bodies = metrics_methods.iter_timed("serialize", bodies, size=lambda item: len(item[0]))
+            # Views that couldn't be created are made again with the next chunk, the rows are recorded all the same.
+            chunk_result, failed_docs, views_result = ingest_methods.upload_file(
+                transport, reconciler, database, checkpoint["headers"], bodies, conflict_policy, csv_file_path,
+                journal_key="offset:" + str(checkpoint["offset"]))
+            result = max(result, chunk_result)
+        with metrics_methods.timed("cleanup"):
+            if failed_docs:
+                methods.write_conflict_rows(csv_file_path, checkpoint["headers"], failed_docs)
+            if bad_lines:
+                conflict_path = methods.write_conflict_lines(csv_file_path, checkpoint["headers"], bad_lines)
+                print(len(bad_lines), "rows that can't be read written to", conflict_path)
+                result = max(result, 1)
+        rows += len(docs) - len(failed_docs)
+        checkpoint["offset"] = end
+        checkpoint.pop("sending", None)
+        save_checkpoint(csv_file_path, checkpoint)
+        journal_methods.remove_journal(csv_file_path)
+    if checkpoint["headers"] is not None:
+        save_checkpoint(csv_file_path, checkpoint)
+    return result, rows
+
+
+def tail_data_from_csv(database_name, csv_file_paths, **options):
+    """
+    Records the rows appended to one or more CSV files since the last run. The files are never deleted.
+
+    Parameters
+    ----------
+    database_name : str
+        Name of the database.
+    csv_file_paths : str or list
+        Path, or paths, of the CSV files.
+    **options
+        Passed on to `record_new_rows`, e.g. max_docs or schema.
+    Returns
+    -------
+    report : dict
+        The number of rows recorded from every file, or its status if it couldn't be fully recorded. One is
+        returned if the database couldn't be reached.
+    """
+    if isinstance(csv_file_paths, str):
+        csv_file_paths = [csv_file_paths]
+    name = database_name.lower()
+    report = {}
+    try:
+        ssh = db_module.ssh_connect()
+        transport = transport_methods.connect(ssh)
+        reconciler = ingest_methods.ViewReconciler(transport, name)
+        for csv_file_path in csv_file_paths:
+            result, rows = record_new_rows(transport, reconciler, name, csv_file_path, **options)
+            report[csv_file_path] = rows if result == 0 else ingest_methods.STATUS[result]
+            print(csv_file_path, rows, "new rows recorded")
+            metrics_methods.write_log(file=csv_file_path, result=ingest_methods.STATUS[result], rows=rows)
+        transport.close()
+        db_module.ssh_disconnect(ssh)
+    except (paramiko.ssh_exception.SSHException, OSError):
+        return 1
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Records the rows appended to CSV files since the last run.")
+    parser.add_argument("database")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--conflicts", choices=methods.CONFLICT_POLICIES, default="report",
+                        help="what to do with rows already in the database")
+    parser.add_argument("--ids", choices=ids_methods.ID_SCHEMES, default="timestamp", help="document id scheme")
+    parser.add_argument("--instrument", default=None, help="name of the instrument prefixing the document ids")
+    parser.add_argument("--serializer", choices=serialize_methods.SERIALIZERS, default=None,
+                        help="JSON library writing the documents, orjson when it's installed")
+    metrics_methods.add_arguments(parser)
+    args = parser.parse_args()
+    metrics_methods.configure(args.metrics_port, args.metrics_log)
+    tail_data_from_csv(args.database, args.files, conflict_policy=args.conflicts, id_scheme=args.ids,
+                       source=args.instrument, serializer=args.serializer)
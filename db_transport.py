@@ -0,0 +1,599 @@
+"""
+HTTP transport to the CouchDB instance.
+
+Requests are sent straight to the CouchDB HTTP API over a pool of keep-alive connections, tunnelled through the
+paramiko SSH connection with a direct-tcpip channel. COUCHDB_HOST is the address of CouchDB as seen from the SSH host,
+so it's never tried from this computer. CouchDB is only reached without SSH when its address is configured, see
+`direct_address`, since a CouchDB that happens to listen here, e.g. in a development container, isn't the lab's.
+
+Large request bodies are sent gzip compressed with "Content-Encoding: gzip", which CouchDB decompresses itself. The
+JSON of the documents repeats the column names on every row and shrinks several times, so far fewer bytes go over a
+slow link.
+"""
+
+import base64
+import configparser
+import contextlib
+import gzip
+import http.client
+import io
+import os
+import queue
+import urllib.parse
+
+import db_metrics as metrics_methods
+import db_ssh as ssh_methods
+
+COUCHDB_HOST = '127.0.0.1'
+COUCHDB_PORT = 5984
+COUCHDB_USER = 'admin'
+COUCHDB_PASSWORD = 'x3n0ntpc'
+POOL_SIZE = 4
+TIMEOUT = 60
+# Bodies smaller than this are sent as they are, compressing them saves too little.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+# A compressed body is only sent if it's at most this fraction of the original.
+COMPRESS_MAX_RATIO = 0.9
+# Address of a CouchDB reached without SSH, host[:port] or a URL.
+DIRECT_ENVIRONMENT = "SLOWPY_COUCHDB_DIRECT"
+
+
+class _ChannelReader(io.RawIOBase):
+    """
+    Raw file object reading from a paramiko channel, so that it can be buffered for http.client.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.channel.recv(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _ChannelSocket:
+    """
+    Wraps a paramiko direct-tcpip channel in the small part of the socket interface that http.client uses.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def sendall(self, data):
+        if self.channel.closed:
+            # Raised like a dropped socket, so the request is sent again on a new channel.
+            raise BrokenPipeError("The SSH channel is closed")
+        self.channel.sendall(data)
+
+    def settimeout(self, timeout):
+        self.channel.settimeout(timeout)
+
+    def makefile(self, mode='rb'):
+        return io.BufferedReader(_ChannelReader(self.channel))
+
+    def close(self):
+        self.channel.close()
+
+
+class TunnelConnection(http.client.HTTPConnection):
+    """
+    HTTP connection that reaches CouchDB through a direct-tcpip channel of an existing SSH connection.
+
+    Parameters
+    ----------
+    ssh : class
+        SSH instance that provides access to the database
+    host : str
+        Address of CouchDB as seen from the SSH host.
+    port : int
+        Port of CouchDB as seen from the SSH host.
+    timeout : float
+        Seconds to wait on the channel before giving up.
+    """
+
+    def __init__(self, ssh, host=COUCHDB_HOST, port=COUCHDB_PORT, timeout=TIMEOUT):
+        super().__init__(host, port, timeout=timeout)
+        self.ssh = ssh
+
+    def connect(self):
+        channel = self.ssh.get_transport().open_channel('direct-tcpip', (self.host, self.port), ('127.0.0.1', 0))
+        self.sock = _ChannelSocket(channel)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+
+
+def compress_body(body, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+    """
+    Compresses a request body with gzip, when it's worth it.
+
+    Parameters
+    ----------
+    body : bytes
+        The body of the request.
+    min_bytes : int
+        (default is COMPRESS_MIN_BYTES)
+        Smallest body that is compressed. Nothing is compressed when None.
+    level : int
+        (default is COMPRESS_LEVEL)
+        Compression level, from 1 (fastest) to 9 (smallest).
+    Returns
+    -------
+    compressed : bytes
+        The compressed body, None if the body is too small or doesn't shrink by much.
+    """
+    if body is None or min_bytes is None or len(body) < min_bytes:
+        return None
+    compressed = gzip.compress(body, level, mtime=0)
+    if len(compressed) > COMPRESS_MAX_RATIO * len(body):
+        return None
+    return compressed
+
+
+class CouchTransport:
+    """
+    Pool of keep-alive HTTP connections to CouchDB.
+
+    Connections are opened lazily, up to `pool_size` of them, and are handed back to the pool after every request
+    so the next request reuses them without a new handshake.
+
+    Parameters
+    ----------
+    ssh : class
+        (default is None)
+        SSH instance to tunnel through, e.g. a `db_ssh.SSHPool`, which makes the SSH connection again when it
+        drops. The connection is made directly when None.
+    host : str
+        (default is COUCHDB_HOST)
+        Address of CouchDB.
+    port : int
+        (default is COUCHDB_PORT)
+        Port of CouchDB.
+    username : str
+        (default is COUCHDB_USER)
+        CouchDB user.
+    password : str
+        (default is COUCHDB_PASSWORD)
+        CouchDB password.
+    pool_size : int
+        (default is POOL_SIZE)
+        Largest number of connections kept open at once.
+    timeout : float
+        (default is TIMEOUT)
+        Seconds to wait on a connection before giving up.
+    compress_min_bytes : int
+        (default is COMPRESS_MIN_BYTES)
+        Smallest POST or PUT body sent gzip compressed, see `compress_body`. Nothing is compressed when None, and
+        compression is turned off by itself if CouchDB answers 415 Unsupported Media Type.
+    """
+
+    def __init__(self, ssh=None, host=COUCHDB_HOST, port=COUCHDB_PORT, username=COUCHDB_USER,
+                 password=COUCHDB_PASSWORD, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 compress_min_bytes=COMPRESS_MIN_BYTES):
+        self.ssh = ssh
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.compress_min_bytes = compress_min_bytes
+        credentials = base64.b64encode((username + ':' + password).encode()).decode()
+        self.headers = {"Authorization": "Basic " + credentials, "Accept": "application/json"}
+        self.idle = queue.LifoQueue()
+        self.slots = queue.Queue()
+        for i in range(pool_size):
+            self.slots.put(i)
+
+    def _new_connection(self):
+        if self.ssh is None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return TunnelConnection(self.ssh, self.host, self.port, self.timeout)
+
+    def _borrow(self):
+        self.slots.get()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def _give_back(self, connection, reusable):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        self.slots.put(None)
+
+    @contextlib.contextmanager
+    def stream(self, method, path, body=None, headers=None):
+        """
+        Sends one request to CouchDB and hands out the response to be read as a stream.
+
+        A connection that was closed by the server while idle is reopened once before the error is raised. Whatever
+        is left of the response is read when the block ends, so the connection can be used again.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method, e.g. 'GET' or 'PUT'.
+        path : str
+            Path of the request, starting with '/'.
+        body : bytes
+            (default is None)
+            Body of the request.
+        headers : dict
+            (default is None)
+            Headers added to the authorization and accept headers.
+        Yields
+        ------
+        status : int
+            HTTP status code of the response.
+        response : http.client.HTTPResponse
+            The response, read with `read(size)`.
+        Throws
+        -----
+        OSError
+            The connection to CouchDB couldn't be made or was lost.
+        """
+        all_headers = dict(self.headers)
+        if body is not None:
+            all_headers["Content-Type"] = "application/json"
+        if headers:
+            all_headers.update(headers)
+        payload = body
+        if method in ("POST", "PUT"):
+            compressed = compress_body(body, self.compress_min_bytes)
+            if compressed is not None:
+                payload = compressed
+                all_headers["Content-Encoding"] = "gzip"
+
+        connection = self._borrow()
+        reusable = False
+        try:
+            for attempt in range(2):
+                try:
+                    connection.request(method, path, body=payload, headers=all_headers)
+                    response = connection.getresponse()
+                    if response.status == 415 and payload is not body:
+                        # This CouchDB doesn't take compressed bodies, they are sent as they are from now on.
+                        response.read()
+                        self.compress_min_bytes = None
+                        payload = body
+                        del all_headers["Content-Encoding"]
+                        connection.request(method, path, body=payload, headers=all_headers)
+                        response = connection.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    connection.close()
+                    if attempt == 1:
+                        raise
+            if payload is not body:
+                metrics_methods.count("compressed_bytes_saved", len(body) - len(payload))
+            yield response.status, response
+            response.read()
+            reusable = not response.will_close
+        finally:
+            self._give_back(connection, reusable)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends one request to CouchDB and reads the whole response, see `stream`.
+
+        Returns
+        -------
+        status : int
+            HTTP status code of the response.
+        data : bytes
+            Body of the response.
+        """
+        with self.stream(method, path, body, headers) as (status, response):
+            return status, response.read()
+
+    def close(self):
+        """
+        Closes every idle connection of the pool.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def direct_address(config_file=None):
+    """
+    Returns the address of CouchDB when it's configured to be reached without SSH.
+
+    The address is taken from SLOWPY_COUCHDB_DIRECT, then from "direct" in the [couchdb] section of the config file
+    of `db_ssh.settings`, e.g. direct = 127.0.0.1:5984 or direct = http://couchdb.lab:5984.
+
+    Parameters
+    ----------
+    config_file : str
+        (default is None)
+        Path of the config file, that of SLOWPY_CONFIG or db_ssh.CONFIG_FILE when None.
+    Returns
+    -------
+    address : tuple
+        The host and port, None if no address is configured.
+    Throws
+    -----
+    ValueError
+        The port isn't an integer.
+    """
+    value = os.environ.get(DIRECT_ENVIRONMENT)
+    if value is None:
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.read(config_file or os.environ.get("SLOWPY_CONFIG", ssh_methods.CONFIG_FILE))
+        value = parser.get("couchdb", "direct", fallback=None)
+    if not value:
+        return None
+    address = urllib.parse.urlsplit(value if "://" in value else "//" + value)
+    return address.hostname, address.port or COUCHDB_PORT
+
+
+def connect(self):
+        channel = self.ssh.get_transport().open_channel('direct-tcpip', (self.host, self.port), ('127.0.0.1', 0))
+        self.sock = _ChannelSocket(channel)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+
+
+def compress_body(body, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+    """
+    Compresses a request body with gzip, when it's worth it.
+
+    Parameters
+    ----------
+    body : bytes
+        The body of the request.
+    min_bytes : int
+        (default is COMPRESS_MIN_BYTES)
+        Smallest body that is compressed. Nothing is compressed when None.
+    level : int
+        (default is COMPRESS_LEVEL)
+        Compression level, from 1 (fastest) to 9 (smallest).
+    Returns
+    -------
+    compressed : bytes
+        The compressed body, None if the body is too small or doesn't shrink by much.
+    """
+    if body is None or min_bytes is None or len(body) < min_bytes:
+        return None
+    compressed = gzip.compress(body, level, mtime=0)
+    if len(compressed) > COMPRESS_MAX_RATIO * len(body):
+        return None
+    return compressed
+
+
+class CouchTransport:
+    """
+    Pool of keep-alive HTTP connections to CouchDB.
+
+    Connections are opened lazily, up to `pool_size` of them, and are handed back to the pool after every request
+    so the next request reuses them without a new handshake.
+
+    Parameters
+    ----------
+    ssh : class
+        (default is None)
+        SSH instance to tunnel through, e.g. a `db_ssh.SSHPool`, which makes the SSH connection again when it
+        drops. The connection is made directly when None.
+    host : str
+        (default is COUCHDB_HOST)
+        Address of CouchDB.
+    port : int
+        (default is COUCHDB_PORT)
+        Port of CouchDB.
+    username : str
+        (default is COUCHDB_USER)
+        CouchDB user.
+    password : str
+        (default is COUCHDB_PASSWORD)
+        CouchDB password.
+    pool_size : int
+        (default is POOL_SIZE)
+        Largest number of connections kept open at once.
+    timeout : float
+        (default is TIMEOUT)
+        Seconds to wait on a connection before giving up.
+    compress_min_bytes : int
+        (default is COMPRESS_MIN_BYTES)
+        Smallest POST or PUT body sent gzip compressed, see `compress_body`. Nothing is compressed when None, and
+        compression is turned off by itself if CouchDB answers 415 Unsupported Media Type.
+    """
+
+    def __init__(self, ssh=None, host=COUCHDB_HOST, port=COUCHDB_PORT, username=COUCHDB_USER,
+                 password=COUCHDB_PASSWORD, pool_size=POOL_SIZE, timeout=TIMEOUT,
+                 compress_min_bytes=COMPRESS_MIN_BYTES):
+        self.ssh = ssh
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.compress_min_bytes = compress_min_bytes
+        credentials = base64.b64encode((username + ':' + password).encode()).decode()
+        self.headers = {"Authorization": "Basic " + credentials, "Accept": "application/json"}
+        self.idle = queue.LifoQueue()
+        self.slots = queue.Queue()
+        for i in range(pool_size):
+            self.slots.put(i)
+
+    def _new_connection(self):
+        if self.ssh is None:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return TunnelConnection(self.ssh, self.host, self.port, self.timeout)
+
+    def _borrow(self):
+        self.slots.get()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self._new_connection()
+
+    def _give_back(self, connection, reusable):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        self.slots.put(None)
+
+    @contextlib.contextmanager
+    def stream(self, method, path, body=None, headers=None):
+        """
+        Sends one request to CouchDB and hands out the response to be read as a stream.
+
+        A connection that was closed by the server while idle is reopened once before the error is raised. Whatever
+        is left of the response is read when the block ends, so the connection can be used again.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method, e.g. 'GET' or 'PUT'.
+        path : str
+            Path of the request, starting with '/'.
+        body : bytes
+            (default is None)
+            Body of the request.
+        headers : dict
+            (default is None)
+            Headers added to the authorization and accept headers.
+        Yields
+        ------
+        status : int
+            HTTP status code of the response.
+        response : http.client.HTTPResponse
+            The response, read with `read(size)`.
+        Throws
+        -----
+        OSError
+            The connection to CouchDB couldn't be made or was lost.
+        """
+        all_headers = dict(self.headers)
+        if body is not None:
+            all_headers["Content-Type"] = "application/json"
+        if headers:
+            all_headers.update(headers)
+        payload = body
+        if method in ("POST", "PUT"):
+            compressed = compress_body(body, self.compress_min_bytes)
+            if compressed is not None:
+                payload = compressed
+                all_headers["Content-Encoding"] = "gzip"
+
+        connection = self._borrow()
+        reusable = False
+        try:
+            for attempt in range(2):
+                try:
+                    connection.request(method, path, body=payload, headers=all_headers)
+                    response = connection.getresponse()
+                    if response.status == 415 and payload is not body:
+                        # This CouchDB doesn't take compressed bodies, they are sent as they are from now on.
+                        response.read()
+                        self.compress_min_bytes = None
+                        payload = body
+                        del all_headers["Content-Encoding"]
+                        connection.request(method, path, body=payload, headers=all_headers)
+                        response = connection.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    connection.close()
+                    if attempt == 1:
+                        raise
+            if payload is not body:
+                metrics_methods.count("compressed_bytes_saved", len(body) - len(payload))
+            yield response.status, response
+            response.read()
+            reusable = not response.will_close
+        finally:
+            self._give_back(connection, reusable)
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Sends one request to CouchDB and reads the whole response, see `stream`.
+
+        Returns
+        -------
+        status : int
+            HTTP status code of the response.
+        data : bytes
+            Body of the response.
+        """
+        with self.stream(method, path, body, headers) as (status, response):
+            return status, response.read()
+
+    def close(self):
+        """
+        Closes every idle connection of the pool.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def is_reachable(host=COUCHDB_HOST, port=COUCHDB_PORT, timeout=1.0):
+    """
+    Checks whether CouchDB can be reached directly, without going through SSH.
+
+    Parameters
+    ----------
+    host : str
+        (default is COUCHDB_HOST)
+        Address of CouchDB.
+    port : int
+        (default is COUCHDB_PORT)
+        Port of CouchDB.
+    timeout : float
+        (default is 1.0)
+        Seconds to wait for the connection.
+    Returns
+    -------
+    bool
+        True if a TCP connection could be opened.
+    """
+    try:
+        socket.create_connection((host, port), timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def connect(ssh=None, host=COUCHDB_HOST, port=COUCHDB_PORT, pool_size=POOL_SIZE,
+            compress_min_bytes=COMPRESS_MIN_BYTES):
+    """
+    Opens a transport to CouchDB, through SSH unless an address to reach it directly is configured.
+
+    Parameters
+    ----------
+    ssh : class
+        (default is None)
+        SSH instance to tunnel through. CouchDB is reached directly at `host` when None.
+    host : str
+        (default is COUCHDB_HOST)
+        Address of CouchDB, as seen from the SSH host when tunnelling.
+    port : int
+        (default is COUCHDB_PORT)
+        Port of CouchDB.
+    pool_size : int
+        (default is POOL_SIZE)
+        Largest number of connections kept open at once.
+    compress_min_bytes : int
+        (default is COMPRESS_MIN_BYTES)
+        Smallest request body sent compressed, None to send every body as it is.
+    Returns
+    -------
+    transport : CouchTransport
+        The transport to pass to `db_module.http_execute`.
+    """
+    if ssh is not None:
+        # Only an address that was configured is used without SSH, never one that merely answers.
+        direct = direct_address()
+        if direct is not None:
+            ssh = None
+            host, port = direct
+    return CouchTransport(ssh, host, port, pool_size=pool_size, compress_min_bytes=compress_min_bytes)
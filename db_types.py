@@ -0,0 +1,201 @@
+"""
+Type inference for the values of the CSV.
+
+CSV fields are all strings. The type of every column is inferred from a sample of rows so that documents can be
+written with native JSON numbers, booleans and nulls instead.
+"""
+
+import itertools
+import json
+import math
+
+import db_methods as methods
+
+SAMPLE_ROWS = 100
+TYPES = ("int", "float", "bool", "empty", "str")
+BOOLEANS = {"true": True, "false": False}
+
+
+def _is_int(value):
+    try:
+        int(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_float(value):
+    try:
+        return math.isfinite(float(value))
+    except ValueError:
+        return False
+
+
+def column_type(values):
+    """
+    Returns the narrowest type that every value of a column can be converted to.
+
+    Parameters
+    ----------
+    values : list
+        String values of one column. Blank values are ignored.
+    Returns
+    -------
+    str
+        One of "int", "float", "bool", "empty" (every value is blank) or "str".
+    """
+    values = [value.strip() for value in values if value is not None and value.strip() != ""]
+    if not values:
+        return "empty"
+    if all(_is_int(value) for value in values):
+        return "int"
+    if all(_is_float(value) for value in values):
+        return "float"
+    if all(value.lower() in BOOLEANS for value in values):
+        return "bool"
+    return "str"
+
+
+def infer_column_types(docs, sample_rows=SAMPLE_ROWS, schema=None):
+    """
+    Infers the type of every column from the first rows of the data.
+
+    Parameters
+    ----------
+    docs : iterable
+        The documents, e.g. from `db_methods.iter_csv_documents`. Only the first `sample_rows` are read.
+    sample_rows : int
+        (default is SAMPLE_ROWS)
+        Number of rows to look at.
+    schema : dict
+        (default is None)
+        Types that override the inferred ones, e.g. {"serial_number": "str"}.
+    Returns
+    -------
+    types : dict
+        The type of every column, see `column_type`.
+    Notes
+    -----
+    The "timestamp" and "_id" columns are always kept as strings.
+    """
+    columns = {}
+    for doc in itertools.islice(docs, sample_rows):
+        for header, value in doc.items():
+            columns.setdefault(header, []).append(value)
+    types = {header: column_type(values) for header, values in columns.items()}
+    types["timestamp"] = "str"
+    types["_id"] = "str"
+    if schema:
+        for header, kind in schema.items():
+            if kind not in TYPES:
+                raise ValueError("Unknown type " + str(kind) + " for column " + str(header))
+            types[header] = kind
+    return types
+
+
+def convert_value(value, kind):
+    """
+    Converts one string value to the given type.
+
+    Blank values become None (null). A value that doesn't fit the type, because the sample didn't show the whole
+    column, is converted to the closest type that fits instead of being lost. NaN and infinity aren't valid JSON, so
+    they stay strings.
+
+    Parameters
+    ----------
+    value : str
+        The value from the CSV.
+    kind : str
+        The type of the column, see `column_type`.
+    Returns
+    -------
+    int, float, bool, str or None
+        The converted value.
+    """
+    if kind == "str" or value is None:
+        return value
+    value = value.strip()
+    if value == "":
+        return None
+    if kind == "bool" and value.lower() in BOOLEANS:
+        return BOOLEANS[value.lower()]
+    if kind != "float":
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    if _is_float(value):
+        return float(value)
+    return value
+
+
+def convert_document(doc, types):
+    """
+    Converts every field of a document to the type of its column.
+
+    Parameters
+    ----------
+    doc : dict
+        The document with string values.
+    types : dict
+        The type of every column, from `infer_column_types`.
+    Returns
+    -------
+    dict
+        A new document with typed values. Columns missing from `types` are kept as strings.
+    """
+    return {header: convert_value(value, types.get(header, "str")) for header, value in doc.items()}
+
+
+def iter_typed_documents(docs, types):
+    """
+    Converts documents one at a time, see `convert_document`.
+
+    Parameters
+    ----------
+    docs : iterable
+        The documents with string values.
+    types : dict
+        The type of every column, from `infer_column_types`.
+    Yields
+    ------
+    doc : dict
+        A document with typed values.
+    """
+    for doc in docs:
+        yield convert_document(doc, types)
+
+
+def document_size_report(data_file_path, sample_rows=SAMPLE_ROWS, schema=None):
+    """
+    Compares the size of the documents of a CSV before and after type conversion.
+
+    Parameters
+    ----------
+    data_file_path : str
+        The name of the csv file containing the data in the project folder.
+    sample_rows : int
+        (default is SAMPLE_ROWS)
+        Number of rows used to infer the types.
+    schema : dict
+        (default is None)
+        Types that override the inferred ones.
+    Returns
+    -------
+    report : dict
+        The inferred types, the number of documents and their total JSON size in bytes before and after conversion.
+    """
+    types = infer_column_types(methods.iter_csv_documents(data_file_path), sample_rows, schema)
+    documents = 0
+    bytes_before = 0
+    bytes_after = 0
+    for doc in methods.iter_csv_documents(data_file_path):
+        documents += 1
+        bytes_before += len(json.dumps(doc).encode())
+        bytes_after += len(json.dumps(convert_document(doc, types)).encode())
+    report = {"types": types, "documents": documents, "bytes_before": bytes_before, "bytes_after": bytes_after}
+    if bytes_before:
+        print("Documents: ", documents)
+        print("Size as strings: ", bytes_before, "bytes")
+        print("Size with types: ", bytes_after, "bytes (" + str(round(100.0 * bytes_after / bytes_before, 1)) + "%)")
+    return report
@@ -0,0 +1,190 @@
+"""
+Checks of a CSV file before any of it is sent to the database.
+
+A file that can't be recorded as it is is rejected before any request is made, instead of failing halfway through
+the upload or leaving documents behind that the views can't read:
+
+    headers      every header is a letter followed by letters, digits or "_", since the views read the values as
+                 doc.<header> and CouchDB keeps fields starting with "_" for itself. Headers are unique, aren't
+                 the names of the fields of buckets ("bucket", "seconds" and "offsets", see `db_buckets`) and there
+                 is a "timestamp" column.
+    timestamps   every timestamp is written yyyy-mm-dd hh:mm:ss, with an optional fraction of a second, which is
+                 what the ids, the views and the queries expect.
+    rows         every row has one field per header.
+    duplicates   no timestamp appears twice, since rows with the same timestamp get the same id.
+
+The file is read once, row by row, so files of any size are checked in little memory besides the set of timestamps.
+
+The fingerprint of the headers names the set of columns of a file. Files with a fingerprint already reconciled with
+a database need no view reconciliation, see `db_module.reconcile_views`.
+
+    python db_validate.py data/*.csv
+"""
+
+import argparse
+import csv
+import hashlib
+import re
+import sys
+
+import db_buckets as buckets_methods
+import db_methods as methods
+
+HEADER = re.compile(r"[A-Za-z][A-Za-z0-9_]*")
+# Fields of the documents of buckets, see `db_buckets`.
+RESERVED_HEADERS = buckets_methods.BUCKET_FIELDS
+TIMESTAMP = re.compile(r"[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01]) "
+                       r"(?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9](?:\.[0-9]{1,6})?")
+# Problems listed before the rest of the file is skipped.
+MAX_PROBLEMS = 10
+
+
+def header_fingerprint(headers):
+    """
+    Returns the fingerprint of a set of headers, the same whatever their order.
+
+    Parameters
+    ----------
+    headers : list
+        The headings of a CSV file.
+    Returns
+    -------
+    str
+        A hexadecimal digest.
+    """
+    return hashlib.sha1("\n".join(sorted(set(headers))).encode()).hexdigest()
+
+
+def check_headers(headers):
+    """
+    Returns what's wrong with the headers of a CSV file.
+
+    Parameters
+    ----------
+    headers : list
+        The headings of the CSV file.
+    Returns
+    -------
+    problems : list
+        A sentence per problem, empty if the headers are fine.
+    """
+    problems = []
+    if "timestamp" not in headers:
+        problems.append("There is no timestamp column")
+    seen = set()
+    for header in headers:
+        if header in seen:
+            problems.append("The header " + repr(header) + " appears more than once")
+        elif not HEADER.fullmatch(header):
+            problems.append("The header " + repr(header) + " isn't a letter followed by letters, digits or _")
+        elif header in RESERVED_HEADERS:
+            problems.append("The header " + repr(header) + " is kept for bucketed documents")
+        seen.add(header)
+    return problems
+
+
+def validate_csv(csv_file_path, max_problems=MAX_PROBLEMS):
+    """
+    Checks a CSV file in one pass, see the checks of this module.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    max_problems : int
+        (default is MAX_PROBLEMS)
+        Stops reading the file once that many problems are found.
+    Returns
+    -------
+    headers : list
+        The headings of the CSV, one if the file can't be found.
+    fingerprint : str
+        The fingerprint of the headers, see `header_fingerprint`. None if the file can't be found.
+    problems : list
+        A sentence per problem, with the line it's on. The file is valid if it's empty.
+    Throws
+    -----
+    csv.Error
+        The file isn't a CSV file that can be read.
+    """
+    headers = methods.read_headers(csv_file_path)
+    if headers == 1:
+        return 1, None, ["The file can't be found"]
+    problems = check_headers(headers)
+    if "timestamp" not in headers:
+        return headers, header_fingerprint(headers), problems
+    position = headers.index("timestamp")
+    width = len(headers)
+    timestamps = set()
+    match = TIMESTAMP.fullmatch
+    with open(csv_file_path, encoding='utf-8-sig', newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader, None)
+        for row in reader:
+            if len(row) != width:
+                if row:
+                    problems.append("Line " + str(reader.line_num) + " has " + str(len(row)) + " fields instead of " +
+                                    str(width))
+            elif not match(row[position]):
+                problems.append("Line " + str(reader.line_num) + " has the timestamp " + repr(row[position]) +
+                                ", which isn't yyyy-mm-dd hh:mm:ss")
+            elif row[position] in timestamps:
+                problems.append("Line " + str(reader.line_num) + " repeats the timestamp " + row[position])
+            else:
+                timestamps.add(row[position])
+                continue
+            if len(problems) >= max_problems:
+                problems.append("The rest of the file wasn't checked")
+                break
+    return headers, header_fingerprint(headers), problems
+
+
+def check_csv(csv_file_path):
+    """
+    Checks a CSV file and raises an error if it can't be recorded, see `validate_csv`.
+
+    Parameters
+    ----------
+    csv_file_path : str
+        Path of the CSV file.
+    Returns
+    -------
+    headers : list
+        The headings of the CSV.
+    fingerprint : str
+        The fingerprint of the headers.
+    Throws
+    -----
+    FileNotFoundError
+        The file can't be found.
+    ValueError
+        The file isn't valid, with every problem found in the message.
+    csv.Error
+        The file isn't a CSV file that can be read.
+    """
+    headers, fingerprint, problems = validate_csv(csv_file_path)
+    if headers == 1:
+        raise FileNotFoundError(csv_file_path)
+    if problems:
+        raise ValueError(csv_file_path + " is invalid: " + "; ".join(problems))
+    return headers, fingerprint
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks CSV files before they are recorded.")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+    invalid = 0
+    for path in args.files:
+        try:
+            headers, fingerprint, problems = validate_csv(path)
+        except csv.Error as error:
+            problems = [str(error)]
+        if problems:
+            invalid += 1
+            print(path, "invalid")
+            for problem in problems:
+                print("   ", problem)
+        else:
+            print(path, "ok", fingerprint)
+    sys.exit(1 if invalid else 0)
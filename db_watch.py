@@ -0,0 +1,369 @@
+"""
+Continuous recording of the CSV files dropped in a directory.
+
+A long running process keeps one connection to the database open and records every CSV as soon as it's complete.
+New files are noticed with inotify on Linux, and by polling the directory everywhere else.
+"""
+
+import argparse
+import csv
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import paramiko
+
+import db_columnar as columnar_methods
+import db_ids as ids_methods
+import db_ingest as ingest_methods
+import db_journal as journal_methods
+import db_metrics as metrics_methods
+import db_methods as methods
+import db_module
+import db_serialize as serialize_methods
+import db_tail as tail_methods
+import db_transport as transport_methods
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+EVENT_HEADER = struct.Struct("iIII")
+SETTLE = 2.0
+INTERVAL = 1.0
+
+
+def _is_data_file(name):
+    return name.endswith(".csv") and not name.endswith("_conflict.csv")
+
+
+class InotifyWatcher:
+    """
+    Reports the CSV files of a directory that were written and closed, or moved in, using Linux inotify.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to watch.
+    modified : bool
+        (default is False)
+        Also reports files as soon as they are written to, while they are still open, e.g. to record the rows
+        appended to a file LabVIEW keeps open.
+    Throws
+    -----
+    OSError
+        inotify isn't available.
+    """
+
+    def __init__(self, directory, modified=False):
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify isn't available")
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | (IN_MODIFY if modified else 0)
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + directory)
+
+    def wait(self, timeout):
+        """
+        Waits up to `timeout` seconds for files to be written.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait.
+        Returns
+        -------
+        paths : list
+            Paths of the CSV files that were written or moved in.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        data = os.read(self.fd, 65536)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if _is_data_file(name):
+                paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Reports the CSV files of a directory whose size or modification time changed, by listing the directory.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to watch.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = {}
+
+    def wait(self, timeout):
+        """
+        Waits `timeout` seconds, then lists the directory.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait.
+        Returns
+        -------
+        paths : list
+            Paths of the CSV files that are new or changed since the last call.
+        """
+        time.sleep(timeout)
+        paths = []
+        current = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and _is_data_file(entry.name):
+                stat = entry.stat()
+                current[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                if self.seen.get(entry.path) != current[entry.path]:
+                    paths.append(entry.path)
+        self.seen = current
+        return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher(directory, use_inotify=True, modified=False):
+    """
+    Returns an inotify watcher when possible, a polling one otherwise.
+
+    Parameters
+    ----------
+    directory : str
+        The directory to watch.
+    use_inotify : bool
+        (default is True)
+        Tries inotify first when True.
+    modified : bool
+        (default is False)
+        Reports files still open as they are written to, see `InotifyWatcher`. The polling watcher always does.
+    Returns
+    -------
+    InotifyWatcher or PollingWatcher
+    """
+    if use_inotify:
+        try:
+            return InotifyWatcher(directory, modified)
+        except (OSError, AttributeError):
+            print("inotify isn't available, polling", directory, "instead")
+    return PollingWatcher(directory)
+
+
+class Connection:
+    """
+    The SSH connection, HTTP transport and known views of one database, reopened when the connection drops.
+
+    Parameters
+    ----------
+    database : str
+        The name of the database.
+    bucketed : bool
+        (default is False)
+        The files are stored in buckets, see `db_buckets`.
+    """
+
+    def __init__(self, database, bucketed=False):
+        self.database = database
+        self.bucketed = bucketed
+        self.ssh = None
+        self.transport = None
+        self.reconciler = None
+
+    def open(self):
+        if self.transport is None:
+            self.ssh = db_module.ssh_connect()
+            self.transport = transport_methods.connect(self.ssh)
+            self.reconciler = ingest_methods.ViewReconciler(self.transport, self.database, bucketed=self.bucketed)
+        return self.transport
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            db_module.ssh_disconnect(self.ssh)
+        self.ssh = None
+        self.transport = None
+        self.reconciler = None
+
+
+def record_file(connection, csv_file_path, conflict_policy="report", **prepare_options):
+    """
+    Records one CSV file and deletes it, keeping the rows that couldn't be recorded in <file>_conflict.csv.
+
+    Parameters
+    ----------
+    connection : Connection
+        The open connection to the database.
+    csv_file_path : str
+        Path of the CSV file.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows already in the database, one of db_methods.CONFLICT_POLICIES.
+    **prepare_options
+        Passed on to `db_ingest.prepare_file`.
+    Returns
+    -------
+    :int
+        A nonzero value indicates an error code, see `db_ingest.upload_file`. Views that couldn't be created are
+        reported, not counted as an error.
+    Throws
+    -----
+    OSError
+        The connection to the database was lost, the file is left as it is and resumed from its journal.
+    """
+    csv_file_path, headers, fingerprint, bodies = ingest_methods.prepare_file(csv_file_path, **prepare_options)
+    if headers == 1:
+        return 1
+    transport = connection.open()
+    result, failed_docs, views_result = ingest_methods.upload_file(transport, connection.reconciler,
+                                                                   connection.database, headers, bodies,
+                                                                   conflict_policy, csv_file_path, fingerprint)
+    status = ingest_methods.file_status(result, views_result)
+    print(csv_file_path, status)
+    with metrics_methods.timed("cleanup"):
+        methods.cleanup_failed_rows(csv_file_path, headers, failed_docs)
+        journal_methods.remove_journal(csv_file_path)
+    metrics_methods.write_log(file=csv_file_path, result=status)
+    return result
+
+
+def watch_directory(database_name, directory, settle=SETTLE, interval=INTERVAL, use_inotify=True, stop=None,
+                    incremental=False, conflict_policy="report", **prepare_options):
+    """
+    Records every CSV file written to a directory until stopped.
+
+    A file is recorded once it hasn't changed for `settle` seconds, so a file that is written in several steps is
+    only recorded when it's complete. Files already in the directory are recorded first.
+
+    Parameters
+    ----------
+    database_name : str
+        Name of the database.
+    directory : str
+        The directory where the CSV files are dropped.
+    settle : float
+        (default is SETTLE)
+        Seconds a file must stay unchanged before it's recorded.
+    interval : float
+        (default is INTERVAL)
+        Seconds between two checks of the directory.
+    use_inotify : bool
+        (default is True)
+        Uses inotify when it's available, polling otherwise.
+    stop : threading.Event
+        (default is None)
+        Stops the watch when set. The watch runs until interrupted when None.
+    incremental : bool
+        (default is False)
+        Records only the rows appended to each file since the last time, see `db_tail`, and keeps the files. Files
+        are recorded as soon as they change, since partly written lines are left for the next time.
+    conflict_policy : str
+        (default is "report")
+        What to do with rows already in the database, one of db_methods.CONFLICT_POLICIES.
+    **prepare_options
+        Passed on to `db_ingest.prepare_file`, e.g. max_docs or schema.
+    Throws
+    -----
+    ValueError
+        Bucketed storage was asked for with incremental recording, since buckets are made from whole files, or the
+        id scheme or instrument isn't valid, see `db_ids.id_maker`.
+    Notes
+    -----
+    Files that can't be read are renamed to *_conflict.csv, except when recording incrementally, since the files
+    are still being written then. Their rows that can't be read are kept in <file>_conflict.csv instead, see
+    `db_tail.record_new_rows`.
+    """
+    bucketed = prepare_options.get("bucket_seconds") is not None
+    if bucketed and incremental:
+        raise ValueError("Bucketed storage can't be used with incremental recording")
+    # Wrong options would make every file fail, so they are checked before watching.
+    ids_methods.id_maker(prepare_options.get("id_scheme", "timestamp"), prepare_options.get("source"))
+    # Appended rows are always read row by row, without buckets, and aren't checked beforehand.
+    tail_options = {key: value for key, value in prepare_options.items()
+                    if key not in ("bucket_seconds", "reader", "validate")}
+    connection = Connection(database_name.lower(), bucketed)
+    watcher = make_watcher(directory, use_inotify, incremental)
+    pending = {entry.path: 0.0 for entry in os.scandir(directory) if entry.is_file() and _is_data_file(entry.name)}
+    print("Watching", directory)
+    try:
+        while stop is None or not stop.is_set():
+            for path in watcher.wait(interval):
+                pending[path] = 0.0 if incremental else time.monotonic()
+            now = time.monotonic()
+            for path in sorted(path for path, changed in pending.items() if now - changed >= settle):
+                if not os.path.exists(path):
+                    del pending[path]
+                    continue
+                try:
+                    if incremental:
+                        connection.open()
+                        result, rows = tail_methods.record_new_rows(connection.transport, connection.reconciler,
+                                                                    connection.database, path,
+                                                                    conflict_policy=conflict_policy,
+                                                                    **tail_options)
+                        metrics_methods.write_log(file=path, result=ingest_methods.STATUS[result], rows=rows)
+                    else:
+                        record_file(connection, path, conflict_policy, **prepare_options)
+                    del pending[path]
+                except (ValueError, csv.Error) as error:
+                    print("Reading", path, "failed:", error)
+                    if not incremental:
+                        methods.cleanup_csv(path, 2)
+                    del pending[path]
+                except (paramiko.ssh_exception.SSHException, OSError) as error:
+                    print("Connection to the database lost, retrying:", error)
+                    connection.close()
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Records every CSV file dropped in a directory.")
+    parser.add_argument("database")
+    parser.add_argument("directory")
+    parser.add_argument("--settle", type=float, default=SETTLE)
+    parser.add_argument("--poll", action="store_true", help="poll the directory instead of using inotify")
+    parser.add_argument("--incremental", action="store_true", help="record appended rows and keep the files")
+    parser.add_argument("--conflicts", choices=methods.CONFLICT_POLICIES, default="report",
+                        help="what to do with rows already in the database")
+    parser.add_argument("--ids", choices=ids_methods.ID_SCHEMES, default="timestamp", help="document id scheme")
+    parser.add_argument("--instrument", default=None, help="name of the instrument prefixing the document ids")
+    parser.add_argument("--bucket-seconds", type=int, default=None,
+                        help="pack the rows of every window of that many seconds into one document")
+    parser.add_argument("--reader", choices=columnar_methods.READERS, default="dict",
+                        help="read the files row by row or column-wise, which is faster for wide files")
+    parser.add_argument("--serializer", choices=serialize_methods.SERIALIZERS, default=None,
+                        help="JSON library writing the documents, orjson when it's installed")
+    parser.add_argument("--no-validate", action="store_true", help="don't check the files before sending them")
+    metrics_methods.add_arguments(parser)
+    args = parser.parse_args()
+    metrics_methods.configure(args.metrics_port, args.metrics_log)
+    watch_directory(args.database, args.directory, args.settle, use_inotify=not args.poll,
+                    incremental=args.incremental, conflict_policy=args.conflicts, id_scheme=args.ids,
+                    source=args.instrument, bucket_seconds=args.bucket_seconds, reader=args.reader,
+                    serializer=args.serializer, validate=not args.no_validate)
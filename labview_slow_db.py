@@ -1,17 +1,19 @@
 import paramiko
 import json
+import argparse
 
 import slow_control as data
 import create_database as create
 import design_docs as design
+import db_module
+import db_watch
 
 
 # SSH FUNCTIONS
-def ssh_connect(hostname='132.206.126.208', port=2020, username='lolx', password='x3n0ntpc'):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(hostname, port, username, password)
-    return ssh
+# The connection is borrowed from the pool of the process and configured with slowpy.ini or the environment,
+# see db_ssh.
+def ssh_connect(hostname=None, port=None, username=None, password=None):
+    return db_module.ssh_connect(hostname, port, username, password)
 
 
 def ssh_execute(ssh, command):
@@ -41,8 +43,7 @@ def ssh_execute(ssh, command):
 
 
 def ssh_disconnect(ssh):
-    ssh.close()
-    return 0
+    return db_module.ssh_disconnect(ssh)
 
 
 # MAIN FUNCTIONS
@@ -87,5 +88,13 @@ def record_data_from_csv(database_name, csv_file):
 
 
 if __name__ == '__main__':
-    create_database("Hello_World")
-    record_data_from_csv("hello_world", "slow_control.csv")
+    # python labview_slow_db.py [database] --watch <export directory> keeps recording every CSV LabVIEW exports there.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("database", nargs="?", default="hello_world")
+    parser.add_argument("--watch", metavar="DIRECTORY", default=None)
+    args = parser.parse_args()
+    if args.watch is not None:
+        db_watch.watch_directory(args.database, args.watch)
+    else:
+        create_database(args.database)
+        record_data_from_csv(args.database.lower(), "slow_control.csv")